@@ -1,80 +1,478 @@
+import argparse
+import logging
+import os
+import re
+import sys
+from collections import OrderedDict
 import cv2
 import numpy as np
 
 """
 This code provides a graphical user interface (GUI) to interactively select a range of colors in the HSV
-(Hue, Saturation, Value) color space from an input image. The purpose is to help users fine-tune the range
+(Hue, Saturation, Value) color space from an input image or video. The purpose is to help users fine-tune the range
 of colors they want to detect or segment from an image.
+Every frame is converted to HSV once, and the mask is only recomputed when the range or the frame changes. The
+frames of a video are scrubbed with a trackbar, and the decoded frames are kept in a bounded LRU cache.
+
+It also provides a headless "auto-range" search that picks the range maximising the detection stability over
+frames sampled from the input video of a tracking config. The range found is only written (into a copy of the
+config given with --output) if it also improves on the range of the config on more frames at the output resolution.
 
 Usage:
-    - Define the path of the image to use in IMAGE_PATH
-    - Run the script
+    - Run the script on an image (default: original_frame.png) or a video:
+        python range_detector.py [--image original_frame.png | --video ../tracking_application/input/Input.mp4]
+    - Search the range of a tracking config (run from `tracking_application/scripts/`, as the tracking):
+        python ../../range_detector/range_detector.py --auto-range ../config_work/config_work_720p.yml \
+            [--output ../config_work/config_work_720p_auto.yml]
 """
 
-IMAGE_PATH = 'original_frame.png'
+# Set up basic logging configuration
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'original_frame.png')
+
+# Source code of the tracking application, whose utils are imported by the auto-range search only
+TRACKING_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tracking_application', 'src')
+sys.path.append(TRACKING_SOURCE)
+
+# Maximum values of the H, S and V channels in OpenCV
+HSV_MAXIMUMS = (179, 255, 255)
+
+WAIT_TIME = 33
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments of the range detector.
+    """
+    parser = argparse.ArgumentParser(description="Select the HSV color range to track, interactively or "
+                                                 "automatically.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--image", default=IMAGE_PATH, help="path of the image to select the range on")
+    source.add_argument("--video", help="path of the video to select the range on, scrubbed with a trackbar")
+    source.add_argument("--auto-range", metavar="CONFIG",
+                        help="search the range on the input video of this tracking config, headless")
+    parser.add_argument("--cache-size", type=int, default=64, help="number of decoded frames kept in memory")
+    parser.add_argument("--output", help="path of the config written by the auto-range search (default: the range "
+                                         "is only reported)")
+    parser.add_argument("--samples", type=int, default=30, help="number of frames sampled by the auto-range search")
+    parser.add_argument("--width", type=int, default=426, help="width of the frames of the auto-range search")
+    parser.add_argument("--verify-samples", type=int, default=60,
+                        help="number of frames, at the output width of the config, on which the range found is "
+                             "compared with the range of the config")
+    parser.add_argument("--step", type=int, default=4, help="step of the range values of the auto-range search")
+    parser.add_argument("--tolerance", type=int, default=1,
+                        help="maximum shift in pixels of a stable point when the range moves by one step")
+    parser.add_argument("--max-area", type=float, default=0.05,
+                        help="maximum fraction of the frame covered by the mask of a detection")
+    return parser.parse_args()
+
+
+class FrameCache:
+    """
+    Decodes the frames of a video and keeps the most recently used ones, with their HSV conversion, in memory.
+    Consecutive frames are read without seeking.
+    """
+
+    def __init__(self, video_path: str, max_size: int = 64):
+        """
+        Open the video.
+        """
+        self._capture = cv2.VideoCapture(video_path)
+        if not self._capture.isOpened():
+            raise FileNotFoundError(f"Couldn't open the video {video_path}.")
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._max_size = max(1, max_size)
+        self._frames = OrderedDict()
+        self._next_index = 0
+
+    def get(self, index: int) -> tuple:
+        """
+        Return the frame at the given index and its HSV conversion, decoding it if needed.
+        """
+        if index in self._frames:
+            self._frames.move_to_end(index)
+            return self._frames[index]
+
+        if index != self._next_index:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        grabbed, frame = self._capture.read()
+        if not grabbed:
+            raise IndexError(f"Couldn't decode frame {index} of the video.")
+        self._next_index = index + 1
+
+        self._frames[index] = (frame, cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+        if len(self._frames) > self._max_size:
+            self._frames.popitem(last=False)
+        return self._frames[index]
+
+    def release(self) -> None:
+        """
+        Release the video.
+        """
+        self._capture.release()
+
+
+def mask_statistics(mask) -> str:
+    """
+    Summarize the mask: the fraction of the frame it covers and its number of blobs.
+    """
+    coverage = cv2.countNonZero(mask) / mask.size * 100
+    blobs = cv2.connectedComponents(mask)[0] - 1
+    return f"mask covers {coverage:.2f}% of the frame in {blobs} blobs"
+
 
 def nothing(x):
     pass
 
-# Create a window
-cv2.namedWindow('image')
-
-# create trackbars for color change
-cv2.createTrackbar('HMin','image',0,179,nothing) # Hue is from 0-179 for Opencv
-cv2.createTrackbar('SMin','image',0,255,nothing)
-cv2.createTrackbar('VMin','image',0,255,nothing)
-cv2.createTrackbar('HMax','image',0,179,nothing)
-cv2.createTrackbar('SMax','image',0,255,nothing)
-cv2.createTrackbar('VMax','image',0,255,nothing)
-
-# Set default value for MAX HSV trackbars.
-cv2.setTrackbarPos('HMax', 'image', 179)
-cv2.setTrackbarPos('SMax', 'image', 255)
-cv2.setTrackbarPos('VMax', 'image', 255)
-
-# Initialize to check if HSV min/max value changes
-hMin = sMin = vMin = hMax = sMax = vMax = 0
-phMin = psMin = pvMin = phMax = psMax = pvMax = 0
-
-img = cv2.imread(IMAGE_PATH)
-output = img
-waitTime = 33
-
-while(1):
-
-    # get current positions of all trackbars
-    hMin = cv2.getTrackbarPos('HMin','image')
-    sMin = cv2.getTrackbarPos('SMin','image')
-    vMin = cv2.getTrackbarPos('VMin','image')
-
-    hMax = cv2.getTrackbarPos('HMax','image')
-    sMax = cv2.getTrackbarPos('SMax','image')
-    vMax = cv2.getTrackbarPos('VMax','image')
-
-    # Set minimum and max HSV values to display
-    lower = np.array([hMin, sMin, vMin])
-    upper = np.array([hMax, sMax, vMax])
-
-    # Create HSV Image and threshold into a range.
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, lower, upper)
-    output = cv2.bitwise_and(img,img, mask= mask)
-
-    # Print if there is a change in HSV value
-    if( (phMin != hMin) | (psMin != sMin) | (pvMin != vMin) | (phMax != hMax) | (psMax != sMax) | (pvMax != vMax) ):
-        print("(hMin = %d , sMin = %d, vMin = %d), (hMax = %d , sMax = %d, vMax = %d)" % (hMin , sMin , vMin, hMax, sMax , vMax))
-        phMin = hMin
-        psMin = sMin
-        pvMin = vMin
-        phMax = hMax
-        psMax = sMax
-        pvMax = vMax
-
-    # Display output image
-    cv2.imshow('image',output)
-
-    # Wait longer to prevent freeze for videos.
-    if cv2.waitKey(waitTime) & 0xFF == ord('q'):
-        break
-
-cv2.destroyAllWindows()
\ No newline at end of file
+
+def select_range(image_path: str = None, video_path: str = None, cache_size: int = 64) -> None:
+    """
+    Display the GUI to select the range on an image, or on the frames of a video.
+    """
+    if video_path:
+        frames = FrameCache(video_path, cache_size)
+    else:
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Couldn't read the image {image_path}.")
+        frames = None
+        frame, hsv = image, cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # Create a window
+    cv2.namedWindow('image')
+
+    # create trackbars for color change
+    cv2.createTrackbar('HMin', 'image', 0, 179, nothing)  # Hue is from 0-179 for Opencv
+    cv2.createTrackbar('SMin', 'image', 0, 255, nothing)
+    cv2.createTrackbar('VMin', 'image', 0, 255, nothing)
+    cv2.createTrackbar('HMax', 'image', 0, 179, nothing)
+    cv2.createTrackbar('SMax', 'image', 0, 255, nothing)
+    cv2.createTrackbar('VMax', 'image', 0, 255, nothing)
+    if frames:
+        cv2.createTrackbar('Frame', 'image', 0, max(0, frames.frame_count - 1), nothing)
+
+    # Set default value for MAX HSV trackbars.
+    cv2.setTrackbarPos('HMax', 'image', 179)
+    cv2.setTrackbarPos('SMax', 'image', 255)
+    cv2.setTrackbarPos('VMax', 'image', 255)
+
+    # The mask is only recomputed when the range or the frame changes
+    previous_state = None
+    while True:
+        lower = (cv2.getTrackbarPos('HMin', 'image'), cv2.getTrackbarPos('SMin', 'image'),
+                 cv2.getTrackbarPos('VMin', 'image'))
+        upper = (cv2.getTrackbarPos('HMax', 'image'), cv2.getTrackbarPos('SMax', 'image'),
+                 cv2.getTrackbarPos('VMax', 'image'))
+        frame_index = cv2.getTrackbarPos('Frame', 'image') if frames else 0
+
+        state = (lower, upper, frame_index)
+        if state != previous_state:
+            if frames:
+                frame, hsv = frames.get(frame_index)
+            mask = cv2.inRange(hsv, lower, upper)
+            cv2.imshow('image', cv2.bitwise_and(frame, frame, mask=mask))
+
+            # Print if there is a change in HSV value
+            if previous_state is None or (lower, upper) != previous_state[:2]:
+                print("(hMin = %d , sMin = %d, vMin = %d), (hMax = %d , sMax = %d, vMax = %d): %s"
+                      % (*lower, *upper, mask_statistics(mask)))
+            previous_state = state
+
+        # Wait longer to prevent freeze for videos.
+        if cv2.waitKey(WAIT_TIME) & 0xFF == ord('q'):
+            break
+
+    if frames:
+        frames.release()
+    cv2.destroyAllWindows()
+
+
+class RangeSearch:
+    """
+    Headless search of the HSV range maximising the detection stability over frames sampled from a video.
+    A detection is stable if the point detected with the range stays within the tolerance when any bound of the
+    range moves by one step, i.e. the range lies in a gap of the colors of the frame, where lighting changes don't
+    move the point. A mask covering more than the maximum area is not a detection.
+    Static features (e.g. reflections) are stable too, so the score of a range counts the stable detections of the
+    frames where the reference range (the range of the config) detects a point, and every false detection costs
+    more than all the stable detections: a detection on a frame where the reference range detects nothing, or a
+    static detection, at a point that is also detected in at least `STATIC_FRAMES` other sampled frames (the
+    target moves, and may only slow down around a few frames, while a static feature is always detected at the
+    same point). A range with false detections thus never scores above a range with fewer of them.
+    The points are computed for all the values of a bound at once: with the other bounds fixed, the masks of the
+    values are nested, so a single pass over every frame ranks its pixels by the value from which they are in the
+    mask. The points of every range are computed once.
+    """
+    STATIC_FRAMES = 3
+
+    def __init__(self, samples: list, regions: list, location_most: str, step: int, tolerance: int,
+                 max_area: float, reference_range: tuple = None):
+        """
+        Initialize the search on the HSV conversion of the sampled frames and the scene regions covering them.
+        Without a reference range, a detection counts on every frame.
+        """
+        self._samples = samples
+        self._regions = regions
+        self._location_most = location_most
+        self._step = step
+        self._tolerance = tolerance
+        self._max_areas = [max_area * (hsv.shape[0] * hsv.shape[1] - (cv2.countNonZero(region.astype(np.uint8))
+                                                                     if region is not None else 0))
+                           for hsv, region in zip(samples, regions)]
+        self._points = {}
+        self._reference_found = [True] * len(samples)
+        if reference_range is not None:
+            self._reference_found = [point is not None for point in self._detect_points(reference_range)]
+
+    def _sweep_frame(self, frame_index: int, color_range: tuple, bound: int, values: list) -> list:
+        """
+        Detect the point of a sampled frame for every value of a bound of the range (lower and upper bounds
+        flattened in a tuple), as `utils_point_track.detect_point` would on the mask of each range.
+        """
+        hsv, region, max_area = self._samples[frame_index], self._regions[frame_index], self._max_areas[frame_index]
+        channel = bound % 3
+        lower, upper = list(color_range[:3]), list(color_range[3:])
+        if bound < 3:
+            lower[channel] = 0
+        else:
+            upper[channel] = HSV_MAXIMUMS[channel]
+        eligible = cv2.inRange(hsv, tuple(lower), tuple(upper))
+        if region is not None:
+            np.copyto(eligible, 0, where=region)
+
+        # Rank of every pixel: it is in the mask of a value if its rank is at least the threshold of the value
+        if bound < 3:
+            ranks = hsv[..., channel].astype(np.int16) + 1
+            thresholds = [value + 1 for value in values]
+        else:
+            ranks = 256 - hsv[..., channel].astype(np.int16)
+            thresholds = [256 - value for value in values]
+        ranks[eligible == 0] = 0
+        areas = np.cumsum(np.bincount(ranks.ravel(), minlength=258)[::-1])[::-1]
+
+        by_rows = self._location_most in ("top", "bottom")
+        line_ranks = ranks.max(axis=1 if by_rows else 0)
+        points = []
+        for threshold in thresholds:
+            if not 0 < areas[threshold] <= max_area:
+                points.append(None)
+                continue
+            lines = np.flatnonzero(line_ranks >= threshold)
+            line = int(lines[0] if self._location_most in ("top", "left") else lines[-1])
+            if by_rows:
+                points.append((int(np.argmax(ranks[line] >= threshold)), line))
+            else:
+                points.append((line, int(np.argmax(ranks[:, line] >= threshold))))
+        return points
+
+    def _sweep(self, color_range: tuple, bound: int, values: list) -> None:
+        """
+        Detect the points of the sampled frames for every value of a bound of the range.
+        """
+        ranges = [color_range[:bound] + (value,) + color_range[bound + 1:] for value in values]
+        missing = [(value, candidate) for value, candidate in zip(values, ranges) if candidate not in self._points]
+        if not missing:
+            return
+        frame_points = [self._sweep_frame(frame_index, color_range, bound, [value for value, _ in missing])
+                        for frame_index in range(len(self._samples))]
+        for index, (_, candidate) in enumerate(missing):
+            self._points[candidate] = [points[index] for points in frame_points]
+
+    def _detect_points(self, color_range: tuple) -> list:
+        """
+        Detect the point of every sampled frame with the range.
+        """
+        if color_range not in self._points:
+            self._sweep(color_range, 0, [color_range[0]])
+        return self._points[color_range]
+
+    def _shift(self, color_range: tuple, bound: int, shift: int) -> tuple:
+        """
+        Move a bound of the range by the shift, within the values of its channel.
+        """
+        value = min(max(0, color_range[bound] + shift), HSV_MAXIMUMS[bound % 3])
+        return color_range[:bound] + (value,) + color_range[bound + 1:]
+
+    def _neighbours(self, color_range: tuple) -> list:
+        """
+        Get the valid ranges where one bound moved by one step.
+        """
+        neighbours = []
+        for bound in range(6):
+            for shift in (-self._step, self._step):
+                neighbour = self._shift(color_range, bound, shift)
+                if neighbour != color_range and all(neighbour[channel] <= neighbour[channel + 3]
+                                                    for channel in range(3)):
+                    neighbours.append(neighbour)
+        return neighbours
+
+    def _is_near(self, point: tuple, other_point: tuple) -> bool:
+        """
+        Check if two points are within the tolerance of each other.
+        """
+        return abs(point[0] - other_point[0]) <= self._tolerance and abs(point[1] - other_point[1]) <= self._tolerance
+
+    def score(self, color_range: tuple) -> int:
+        """
+        Count the stable detections of the range on the frames where the reference range detects a point, minus
+        its false detections (on the frames where the reference range detects nothing, or at static points), each
+        weighing as much as all the sampled frames.
+        """
+        points = self._detect_points(color_range)
+        static = [point is not None and sum(other_point is not None and self._is_near(point, other_point)
+                                            for other_point in points) > self.STATIC_FRAMES
+                  for point in points]
+        stable = [point is not None and found and not is_static
+                  for point, found, is_static in zip(points, self._reference_found, static)]
+        for neighbour in self._neighbours(color_range):
+            for index, (point, neighbour_point) in enumerate(zip(points, self._detect_points(neighbour))):
+                if stable[index] and (neighbour_point is None or not self._is_near(point, neighbour_point)):
+                    stable[index] = False
+        false_detections = sum(point is not None and not found for point, found in zip(points, self._reference_found))
+        return sum(stable) - len(points) * (false_detections + sum(static))
+
+    def search(self, color_range: tuple, max_rounds: int = 4) -> tuple:
+        """
+        Improve the range one bound at a time, trying all the values of the bound on the grid of the step, until no
+        bound changes. Ties are broken by the value closest to the current one.
+        Return the best range and its score.
+        """
+        best_score = self.score(color_range)
+        for _ in range(max_rounds):
+            changed = False
+            for bound in range(6):
+                channel = bound % 3
+                if bound < 3:
+                    low, high = 0, color_range[channel + 3]
+                else:
+                    low, high = color_range[channel], HSV_MAXIMUMS[channel]
+                values = sorted(set(range(low, high + 1, self._step)) | {high, color_range[bound]})
+                sweep_values = sorted({min(max(0, value + shift), HSV_MAXIMUMS[channel])
+                                       for value in values for shift in (-self._step, 0, self._step)})
+
+                # Sweep the bound on the range and on its neighbours along the other bounds at once
+                self._sweep(color_range, bound, sweep_values)
+                for other_bound in range(6):
+                    if other_bound != bound:
+                        for shift in (-self._step, self._step):
+                            self._sweep(self._shift(color_range, other_bound, shift), bound, values)
+
+                candidates = [color_range[:bound] + (value,) + color_range[bound + 1:] for value in values]
+                score, _, candidate = max((self.score(candidate), -abs(candidate[bound] - color_range[bound]),
+                                           candidate) for candidate in candidates)
+                if score > best_score:
+                    best_score, color_range, changed = score, candidate, True
+            if not changed:
+                break
+        return color_range, best_score
+
+
+def _sample_frames(config, samples: int, width: int) -> tuple:
+    """
+    Sample frames evenly from the input video of the config, downscaled to the given width and blurred with the
+    blur kernel of the config scaled accordingly, as in the tracking.
+    Return their HSV conversions and the scene regions covering them.
+    """
+    from utils import utils_mask, utils_video
+
+    capture = cv2.VideoCapture(config.get("video_input_path"))
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    indexes = set(np.linspace(0, max(0, frame_count - 1), min(samples, frame_count)).astype(int).tolist())
+    ratio = width / config.get("output_width")
+    blur_ksize = tuple(max(1, int(size * ratio)) // 2 * 2 + 1 for size in config.get("blur_ksize"))
+    scene_masks = utils_mask.SceneMaskCache(config.get("scenes"))
+
+    hsv_frames, regions = [], []
+    for index in range(frame_count):
+        grabbed = capture.grab()
+        if not grabbed:
+            break
+        if index not in indexes:
+            continue
+        frame = utils_video.resize_frame(capture.retrieve()[1], width, config.get("resize_interpolation"))
+        hsv_frames.append(cv2.cvtColor(cv2.GaussianBlur(frame, blur_ksize, sigmaX=0), cv2.COLOR_BGR2HSV))
+        regions.append(scene_masks.get(config.get("scene"), *frame.shape[:2]))
+    capture.release()
+    return hsv_frames, regions
+
+
+def write_range(config_path: str, output_path: str, lower_color: tuple, upper_color: tuple) -> None:
+    """
+    Write the range into the config, replacing the values of `lower_color` and `upper_color` and keeping the rest
+    of the file, comments included.
+    """
+    with open(config_path, 'r') as file:
+        content = file.read()
+    for name, values in (("lower_color", lower_color), ("upper_color", upper_color)):
+        content, replacements = re.subn(rf"^{name}:\s*\[[^\]]*\]", f"{name}: [{', '.join(map(str, values))}]",
+                                        content, flags=re.MULTILINE)
+        if not replacements:
+            content += f"\n{name}: [{', '.join(map(str, values))}]\n"
+    with open(output_path, 'w') as file:
+        file.write(content)
+
+
+def auto_range(config_path: str, output_path: str = None, samples: int = 30, width: int = 426, step: int = 4,
+               tolerance: int = 1, max_area: float = 0.05, verify_samples: int = 60) -> tuple:
+    """
+    Search the range maximising the detection stability on the input video of the config, starting from the range
+    of the config. The range found is kept if it also improves on the range of the config on other frames at the
+    output resolution, where the tracking runs: the search is faster on small frames, but a range may only detect
+    (or miss) faint features at the output resolution. If it is kept and an output path is given, write the config
+    with the range found into it.
+    Return the lower and upper bounds of the range.
+    """
+    from utils import utils_config
+
+    config = utils_config.load_config(config_path)
+    if config.get("use_livecam"):
+        raise ValueError("The range of a live camera config cannot be searched.")
+    hsv_frames, regions = _sample_frames(config, samples, min(width, config.get("output_width")))
+    initial_range = tuple(config.get("lower_color")) + tuple(config.get("upper_color"))
+    search = RangeSearch(hsv_frames, regions, config.get("location_most"), step, tolerance, max_area, initial_range)
+
+    initial_score = search.score(initial_range)
+    color_range, score = search.search(initial_range)
+    logging.info(f"Range of the config: score {initial_score}/{len(hsv_frames)}.")
+    logging.info(f"Range found: lower_color {list(color_range[:3])}, upper_color {list(color_range[3:])}, "
+                 f"score {score}/{len(hsv_frames)}.")
+
+    if score > initial_score:
+        # Compare the ranges on frames at the output resolution
+        hsv_frames, regions = _sample_frames(config, verify_samples, config.get("output_width"))
+        verification = RangeSearch(hsv_frames, regions, config.get("location_most"), step, tolerance, max_area,
+                                   initial_range)
+        initial_score, score = verification.score(initial_range), verification.score(color_range)
+        logging.info(f"At the output resolution: score {initial_score}/{len(hsv_frames)} with the range of the "
+                     f"config, {score}/{len(hsv_frames)} with the range found.")
+    if score <= initial_score:
+        logging.info("The range found doesn't improve on the range of the config. Nothing is written.")
+        return initial_range[:3], initial_range[3:]
+    if output_path is None:
+        logging.info("Use --output to write a config with the range found.")
+    else:
+        write_range(config_path, output_path, color_range[:3], color_range[3:])
+        logging.info(f"Range written to {output_path}.")
+    return color_range[:3], color_range[3:]
+
+
+def main():
+    """
+    Main function of the range detector.
+    """
+    arguments = parse_arguments()
+    try:
+        if arguments.auto_range:
+            auto_range(arguments.auto_range, arguments.output, arguments.samples, arguments.width, arguments.step,
+                       arguments.tolerance, arguments.max_area, arguments.verify_samples)
+        else:
+            select_range(arguments.image, arguments.video, arguments.cache_size)
+    except FileNotFoundError as e:
+        logging.error(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+python ../src/batch_track.py ../config_work/config_work_240p.yml ../config_work/config_work_360p.yml ../config_work/config_work_480p.yml ../config_work/config_work_720p.yml
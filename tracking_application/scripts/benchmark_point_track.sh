@@ -0,0 +1 @@
+python ../src/benchmark_point_track.py ../config_work/config_work_720p.yml
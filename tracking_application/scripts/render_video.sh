@@ -0,0 +1 @@
+python ../src/render_video.py ../config_work/config_work_720p.yml
@@ -0,0 +1,132 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+from utils import utils_config, utils_track
+
+
+"""
+This script serves as the batch entry point for the video tracking application. It is responsible for:
+- Loading each tracking configuration once from the provided YAML files.
+- Building one job per configuration, or per configuration and input video when a glob of videos is given.
+- Running the jobs in a pool of processes that share the code loaded by this script.
+- Writing one JSON summary with the timing of every job.
+"""
+
+# Set up basic logging configuration
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Default path of the batch summary
+SUMMARY_PATH = os.path.join(utils_config.Config.OUTPUT_DIRECTORY, "batch_summary.json")
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments of the batch.
+    """
+    parser = argparse.ArgumentParser(description="Track many videos or configurations in parallel.")
+    parser.add_argument("configs", nargs="+", help="paths to the YAML config files")
+    parser.add_argument("--inputs", default=None,
+                        help="glob of input videos; every config is run on every matching video")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--summary", default=SUMMARY_PATH, help="path of the JSON summary")
+    return parser.parse_args()
+
+
+def build_jobs(config_paths: list, inputs_pattern: str or None) -> list:
+    """
+    Build the list of jobs as (config path, config) pairs.
+    Each YAML file is parsed once; jobs on different input videos get their own output names.
+    """
+    video_input_paths = sorted(glob.glob(inputs_pattern)) if inputs_pattern else [None]
+    if not video_input_paths:
+        raise FileNotFoundError(f"No input videos match '{inputs_pattern}'.")
+
+    jobs = []
+    for config_path in config_paths:
+        base_config = utils_config.load_config(config_path)
+        for video_input_path in video_input_paths:
+            config = base_config.copy()
+
+            # Windows cannot be shown from several processes at once
+            config.set("show_video", False)
+            if video_input_path is not None:
+                input_name = os.path.splitext(os.path.basename(video_input_path))[0]
+                config.set("video_input_path", video_input_path)
+                config.set("output_name", f"{config.get('output_name')}_{input_name}")
+                config.set("data_file_name", f"{config.get('data_file_name')}_{input_name}")
+            jobs.append((config_path, config))
+    return jobs
+
+
+def _init_worker():
+    """
+    Initialize a worker process.
+    Every process already runs one job at a time, so OpenCV's own threads would only oversubscribe the cores.
+    """
+    cv2.setNumThreads(1)
+
+
+def run_job(config_path: str, config: utils_config.Config) -> dict:
+    """
+    Run one tracking job and return its summary.
+    """
+    summary = {"config": config_path, "video_input_path": config.get("video_input_path"),
+               "output_name": config.get("output_name"), "data_file_name": config.get("data_file_name")}
+    start = time.perf_counter()
+    try:
+        if config.get("use_livecam"):
+            raise ValueError("Live camera configs cannot be run in batch mode.")
+        summary["frames"] = utils_track.track(config)
+        summary["status"] = "ok"
+    except Exception as e:
+        summary["status"] = "error"
+        summary["error"] = str(e)
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    if summary["status"] == "ok" and summary["seconds"] > 0:
+        summary["fps"] = round(summary["frames"] / summary["seconds"], 2)
+    return summary
+
+
+def main():
+    """
+    Main function to execute the batch of tracking jobs.
+
+    Usage:
+        python batch_track.py <config-file> [<config-file> ...] [--inputs "<glob>"] [--workers N] [--summary path]
+    """
+    arguments = parse_arguments()
+    start = time.perf_counter()
+
+    try:
+        jobs = build_jobs(arguments.configs, arguments.inputs)
+    except FileNotFoundError as e:
+        logging.error(f"{e}")
+        return 1
+
+    workers = max(1, min(arguments.workers or 1, len(jobs)))
+    logging.info(f"Running {len(jobs)} jobs on {workers} worker processes...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(run_job, config_path, config) for config_path, config in jobs]
+        results = []
+        for future in futures:
+            result = future.result()
+            logging.info(f"{result['config']} ({result['video_input_path']}): {result['status']} "
+                         f"in {result['seconds']} s")
+            results.append(result)
+
+    summary = {"workers": workers, "seconds": round(time.perf_counter() - start, 3), "jobs": results}
+    with open(arguments.summary, "w") as file:
+        json.dump(summary, file, indent=2)
+    logging.info(f"Batch summary saved in {arguments.summary}")
+
+    return 0 if all(result["status"] == "ok" for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import logging
+import sys
+import time
+import cv2
+import imutils
+import numpy as np
+from utils import utils_config, utils_mask, utils_point_track
+
+
+"""
+This script benchmarks the point detection functions against the previous argwhere-based implementation.
+It is responsible for:
+- Building the sample masks from the input video with the tracking pipeline of the provided YAML file.
+- Checking that both implementations return the same coordinates for every mask and location.
+- Reporting the time per mask of each implementation.
+"""
+
+# Set up basic logging configuration
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Number of times each mask is processed by each implementation
+REPEATS = 20
+
+
+def detect_point_argwhere(mask: np.ndarray, location_most: str) -> tuple or None:
+    """
+    Previous implementation of the point detection, kept as reference for the benchmark.
+    """
+    if mask.max() != 255:
+        return None
+    points = np.argwhere(mask == 255)
+    if location_most == "left":
+        point = points[np.argmin(points[:, 1])]
+    elif location_most == "right":
+        point = points[np.argmax(points[:, 1])]
+    elif location_most == "top":
+        point = points[np.argmin(points[:, 0])]
+    else:
+        point = points[np.argmax(points[:, 0])]
+    return tuple(point[::-1])
+
+
+def build_masks(config: utils_config.Config) -> list:
+    """
+    Build the masks of every frame of the input video as done by the tracking pipeline.
+    """
+    scene_masks = utils_mask.SceneMaskCache(config.get("scenes"), config.get("scene_cache_size"))
+    vs = cv2.VideoCapture(config.get("video_input_path"))
+    masks = []
+    while True:
+        grabbed, frame = vs.read()
+        if not grabbed:
+            break
+        frame = imutils.resize(frame, width=config.get("output_width"))
+        blurred = cv2.GaussianBlur(frame, tuple(config.get("blur_ksize")), sigmaX=0)
+        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, tuple(config.get("lower_color")), tuple(config.get("upper_color")))
+        masks.append(utils_mask.modify_mask(mask, config.get("scene"), scene_masks))
+    vs.release()
+
+    # Add a large glowing blob, the worst case for the argwhere-based implementation
+    blob = np.zeros_like(masks[0])
+    blob[blob.shape[0] // 4:, blob.shape[1] // 4:] = 255
+    masks.append(blob)
+    return masks
+
+
+def time_detection(detect, masks: list, location_most: str) -> float:
+    """
+    Return the mean time in microseconds that the detection takes per mask.
+    """
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for mask in masks:
+            detect(mask, location_most)
+    return (time.perf_counter() - start) / (REPEATS * len(masks)) * 1e6
+
+
+def main():
+    """
+    Main function to execute the benchmark.
+
+    Usage:
+        python benchmark_point_track.py <path-to-yaml-config-file>
+    """
+    if len(sys.argv) != 2:
+        logging.error("Incorrect number of arguments.")
+        logging.info("Usage: python benchmark_point_track.py <path-to-yaml-config-file>")
+        return 1
+
+    config = utils_config.load_config_from_files()
+    masks = build_masks(config)
+    logging.info(f"Benchmarking {len(masks)} masks of {masks[0].shape[1]}x{masks[0].shape[0]}.")
+
+    for location_most in sorted(utils_config.Config.LOCATIONS_MOST):
+        for mask in masks:
+            expected = detect_point_argwhere(mask, location_most)
+            point = utils_point_track.detect_point(mask, location_most)
+            if (expected is None) != (point is None) or (point is not None and tuple(expected) != tuple(point)):
+                logging.error(f"Mismatch for location '{location_most}': {expected} != {point}")
+                return 1
+
+        reference_time = time_detection(detect_point_argwhere, masks, location_most)
+        new_time = time_detection(utils_point_track.detect_point, masks, location_most)
+        logging.info(f"{location_most:>6}: argwhere {reference_time:8.1f} us/mask, "
+                     f"reductions {new_time:8.1f} us/mask, speedup x{reference_time / new_time:.1f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
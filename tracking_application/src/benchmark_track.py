@@ -0,0 +1,120 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+from utils import utils_config, utils_timing, utils_track, utils_video
+
+
+"""
+This script benchmarks the tracking application on the provided configurations. It is responsible for:
+- Running every configuration headless (without video display) on its input video.
+- Measuring the frames per second, the per-frame latency percentiles and the duration of every pipeline stage
+  (decode, gate, resize, blur, hsv, in_range, scene_mask, detect, draw, encode, data_write, display).
+- Measuring the cold start, from the loading of the configuration to the first detection.
+- Writing the results as JSON, so they can be compared across versions to catch regressions.
+"""
+
+# Set up basic logging configuration
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+# Default path of the benchmark results
+RESULTS_PATH = os.path.join(utils_config.Config.OUTPUT_DIRECTORY, "benchmark.json")
+
+# Prefix of the output files written during the benchmark
+OUTPUT_PREFIX = "benchmark_"
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the tracking on the provided configurations.")
+    parser.add_argument("configs", nargs="+", help="paths to the YAML config files")
+    parser.add_argument("--output", default=RESULTS_PATH, help="path of the JSON results")
+    parser.add_argument("--keep-outputs", action="store_true",
+                        help="keep the video and data files written during the benchmark")
+    return parser.parse_args()
+
+
+def _remove_outputs(config: utils_config.Config) -> None:
+    """
+    Remove the video and data files written by a benchmark run.
+    """
+    output_directory = config.get("output_directory")
+    paths = [utils_video.video_output_path(output_directory, config.get("output_name"), config.get("output_format"),
+                                           config.get("video_output_mode"))]
+    paths += [os.path.join(output_directory, 'data', f'{config.get("data_file_name")}.{data_format}')
+              for data_format in config.get("data_formats")]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def benchmark_config(config_path: str, keep_outputs: bool = False) -> dict:
+    """
+    Run the tracking of a configuration headless and return its measurements.
+    """
+    started_at = time.perf_counter()
+    config = utils_config.load_config(config_path)
+    if config.get("use_livecam"):
+        raise ValueError(f"{config_path}: live camera configs cannot be benchmarked.")
+
+    config.set("show_video", False)
+    config.set("output_name", f"{OUTPUT_PREFIX}{config.get('output_name')}")
+    config.set("data_file_name", f"{OUTPUT_PREFIX}{config.get('data_file_name')}")
+
+    timer = utils_timing.StageTimer()
+    tracker = utils_track.RunTrack(config, timer=timer, started_at=started_at)
+    tracker.run()
+    if not keep_outputs:
+        _remove_outputs(config)
+
+    result = {"config": config_path,
+              "resolution": f"{config.get('output_width')}x{config.get('output_height')}",
+              "save_video": config.get("save_video"), "save_data": config.get("save_data"),
+              "pipeline_workers": config.get("pipeline_workers"),
+              "cold_start_ms": round(tracker.cold_start * 1000, 2) if tracker.cold_start is not None else None,
+              "skipped_frames": tracker.frame_gate.skipped_frames if tracker.frame_gate else 0}
+    result.update(timer.summary())
+    return result
+
+
+def main():
+    """
+    Main function to execute the benchmark.
+
+    Usage:
+        python benchmark_track.py <config-file> [<config-file> ...] [--output path] [--keep-outputs]
+    """
+    arguments = parse_arguments()
+
+    results = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "versions": {"python": platform.python_version(), "opencv": cv2.__version__,
+                            "numpy": np.__version__},
+               "machine": {"platform": platform.platform(), "cpu_count": os.cpu_count()},
+               "runs": []}
+    for config_path in arguments.configs:
+        try:
+            run = benchmark_config(config_path, arguments.keep_outputs)
+        except Exception as e:
+            logging.error(f"Benchmark of {config_path} failed: {e}")
+            return 1
+
+        latency = run["latency_ms"]
+        logging.info(f"{config_path}: {run['fps']} fps, latency p50 {latency.get('p50')} ms, "
+                     f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms")
+        results["runs"].append(run)
+
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=2)
+    logging.info(f"Benchmark results saved in {arguments.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,9 @@
+import time
+
+# Start of the process, taken before the other imports to measure the cold start to the first detection
+STARTED_AT = time.perf_counter()
+
+import argparse
 import logging
 import sys
 from utils import utils_config, utils_track
@@ -14,26 +20,38 @@ This script serves as the main entry point for the video tracking application. I
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 
+def parse_arguments():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Track the point of interest in a video.")
+    parser.add_argument("config", help="path to the YAML config file")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="number of frame ranges of the video file tracked in parallel processes")
+    return parser.parse_args()
+
+
 def main():
     """
     Main function to execute the video tracking process.
     Loads configurations from a YAML file and initiates the tracking.
 
     Usage:
-        python main_track.py <path-to-yaml-config-file>
+        python main_track.py <path-to-yaml-config-file> [--shards N]
     """
-    # Ensure the correct number of arguments are provided
-    if len(sys.argv) != 2:
-        logging.error("Incorrect number of arguments.")
-        logging.info("Usage: python main_track.py <path-to-yaml-config-file>")
-        return 1
+    arguments = parse_arguments()
 
     try:
         # Load the configuration of the tracking
-        config = utils_config.load_config_from_files()
+        config = utils_config.load_config(arguments.config)
 
         # Track
-        utils_track.track(config)
+        if arguments.shards > 1:
+            # Imported here, so the process pool is only loaded when the video is sharded
+            from utils import utils_shards
+            utils_shards.track_sharded(config, arguments.shards)
+        else:
+            utils_track.track(config, STARTED_AT)
 
     except FileNotFoundError:
         logging.error("Config file not found. Please provide a valid path.")
@@ -0,0 +1,64 @@
+import argparse
+import logging
+import sys
+from utils import utils_config, utils_track, utils_video
+
+
+"""
+This script renders the annotated video of a tracking run saved with `video_output_mode: "overlay"`.
+It is responsible for:
+- Loading the overlay metadata (the detections drawn on every frame) saved in the output directory.
+- Drawing the detections, and the frame numbers and coordinates if configured, on the frames of the input video.
+- Encoding the annotated video in the output directory, as in the "encoded" output mode.
+"""
+
+# Set up basic logging configuration
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments of the rendering.
+    """
+    parser = argparse.ArgumentParser(description="Render the annotated video from the overlay metadata.")
+    parser.add_argument("config", help="path to the YAML config file of the tracking run")
+    parser.add_argument("--overlay", help="path of the overlay metadata (default: the one of the config)")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main function to render the annotated video.
+
+    Usage:
+        python render_video.py <config-file> [--overlay path]
+    """
+    arguments = parse_arguments()
+
+    try:
+        config = utils_config.load_config(arguments.config)
+        if config.get("use_livecam"):
+            raise ValueError("The video of a live camera run cannot be rendered.")
+        overlay_path = arguments.overlay or utils_video.video_output_path(
+            config.get("output_directory"), config.get("output_name"), config.get("output_format"), "overlay")
+        overlay, multi_target = utils_video.load_overlay(overlay_path)
+
+        config.set("video_output_mode", "encoded")
+        config.set("show_video", False)
+        config.set("save_video", True)
+        frame_count = utils_track.RunTrack(config).render(overlay, multi_target)
+    except FileNotFoundError as e:
+        logging.error(f"File not found: {e.filename}")
+        return 1
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+        return 1
+
+    video_path = utils_video.video_output_path(config.get("output_directory"), config.get("output_name"),
+                                               config.get("output_format"), "encoded")
+    logging.info(f"Rendered {frame_count} frames in {video_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import logging
+import os
+import cv2
+import numpy as np
+
+"""
+Utility functions to threshold images with a fixed HSV color range without converting them to the HSV color space.
+`ColorLUT` is a lookup table of the BGR colors whose HSV conversion is in the range, built once with OpenCV's own
+conversion (so it gives exactly the same mask) and cached on disk, keyed by the range values.
+The table is stored at the lowest bit depth per channel at which it is exact. The smallest BGR box containing the
+colors of the range gives a single-pass threshold when the range fills it, and otherwise only the bounding box of
+the pixels whose value is in the range is looked up.
+"""
+
+# Directory of the cached lookup tables
+CACHE_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(__file__), "../../cache"))
+
+# Bit depths per channel tried for the lookup table, from the smallest
+LUT_BIT_DEPTHS = (4, 5, 6, 7, 8)
+
+
+def build_color_lut(lower_color, upper_color) -> tuple:
+    """
+    Build the lookup table of the BGR colors whose HSV conversion is in the range.
+    Return the bit depth per channel and the flat table (255 for the colors in the range, 0 otherwise).
+    """
+    levels = np.arange(256, dtype=np.uint8)
+    colors = np.empty((256, 256, 256, 3), dtype=np.uint8)
+    colors[..., 0] = levels[:, None, None]
+    colors[..., 1] = levels[None, :, None]
+    colors[..., 2] = levels[None, None, :]
+    hsv = cv2.cvtColor(colors.reshape(4096, 4096, 3), cv2.COLOR_BGR2HSV)
+    table = cv2.inRange(hsv, tuple(lower_color), tuple(upper_color)).reshape(256, 256, 256)
+
+    # Keep the lowest bit depth at which all the colors of every cell of the table have the same result
+    for bits in LUT_BIT_DEPTHS:
+        cell = 1 << (8 - bits)
+        cells = table.reshape(1 << bits, cell, 1 << bits, cell, 1 << bits, cell)
+        if bits == 8 or (cells.min(axis=(1, 3, 5)) == cells.max(axis=(1, 3, 5))).all():
+            return bits, np.ascontiguousarray(cells[:, 0, :, 0, :, 0]).ravel()
+
+
+def load_color_lut(lower_color, upper_color, cache_directory: str = CACHE_DIRECTORY) -> tuple:
+    """
+    Load the lookup table of the color range from the cache, building and caching it if needed.
+    Return the bit depth per channel and the flat table.
+    """
+    key = "_".join("-".join(str(int(value)) for value in color) for color in (lower_color, upper_color))
+    path = os.path.join(cache_directory, f"color_lut_{key}_opencv{cv2.__version__}.npz")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            bits = int(data["bits"])
+            return bits, np.unpackbits(data["table"], count=1 << (3 * bits)) * np.uint8(255)
+
+    bits, table = build_color_lut(lower_color, upper_color)
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        # Write to a temporary file first, so concurrent runs never read a partial table
+        temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(temporary_path, bits=bits, table=np.packbits(table > 0))
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logging.warning(f"Color lookup table couldn't be cached in {cache_directory}: {e}")
+    return bits, table
+
+
+class ColorLUT:
+    """
+    Threshold of BGR images with a fixed HSV color range through a lookup table.
+
+    Basic Usage:
+        color_lut = ColorLUT(lower_color, upper_color)
+        mask = color_lut.threshold(image)
+    """
+
+    def __init__(self, lower_color, upper_color, cache_directory: str = CACHE_DIRECTORY):
+        """
+        Load the lookup table of the color range and derive the BGR box and value range of its colors.
+        """
+        self.bits, self.table = load_color_lut(lower_color, upper_color, cache_directory)
+        self._shift = 8 - self.bits
+
+        cells = np.flatnonzero(self.table)
+        self.empty = cells.size == 0
+        if self.empty:
+            return
+        cell = (1 << self._shift) - 1
+        level_mask = (1 << self.bits) - 1
+        blue, green, red = cells >> (2 * self.bits), (cells >> self.bits) & level_mask, cells & level_mask
+        self.bgr_lower = tuple(int(channel.min()) << self._shift for channel in (blue, green, red))
+        self.bgr_upper = tuple((int(channel.max()) << self._shift) | cell for channel in (blue, green, red))
+
+        # The value (maximum of B, G and R) of the colors of the range
+        values = np.maximum(np.maximum(blue, green), red)
+        self.value_lower = int(values.min()) << self._shift
+        self.value_upper = (int(values.max()) << self._shift) | cell
+
+        # If every color of the box is in the range, thresholding the BGR box is exact
+        box = self.table.reshape((1 << self.bits,) * 3)[
+            self.bgr_lower[0] >> self._shift:(self.bgr_upper[0] >> self._shift) + 1,
+            self.bgr_lower[1] >> self._shift:(self.bgr_upper[1] >> self._shift) + 1,
+            self.bgr_lower[2] >> self._shift:(self.bgr_upper[2] >> self._shift) + 1]
+        self.box_exact = bool(box.all())
+
+    def lookup(self, image) -> np.ndarray:
+        """
+        Look up the mask of every pixel of the image in the table.
+        """
+        channels = image.astype(np.int32)
+        if self._shift:
+            channels >>= self._shift
+        return self.table.take((channels[..., 0] << (2 * self.bits)) | (channels[..., 1] << self.bits)
+                               | channels[..., 2])
+
+    def threshold(self, image) -> np.ndarray:
+        """
+        Compute the mask of the pixels of the image whose HSV conversion is in the range.
+        """
+        if self.empty:
+            return np.zeros(image.shape[:2], dtype=np.uint8)
+        if self.box_exact:
+            return cv2.inRange(image, self.bgr_lower, self.bgr_upper)
+
+        # Only the pixels whose value is in the range of the colors of the table can be in the mask
+        blue, green, red = cv2.split(image)
+        value = cv2.max(cv2.max(blue, green, dst=blue), red, dst=blue)
+        left, top, width, height = cv2.boundingRect(cv2.inRange(value, self.value_lower, self.value_upper))
+        mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        if width:
+            mask[top:top + height, left:left + width] = self.lookup(image[top:top + height, left:left + width])
+        return mask
@@ -1,12 +1,21 @@
+import copy
+import hashlib
+import os
 import sys
 import yaml
 import logging
-from . import utils_paths, utils_strings
+from collections import namedtuple
+from types import MappingProxyType
+import cv2
+import numpy as np
+from . import utils_paths, utils_strings, utils_mask, utils_data, utils_point_track, utils_metrics, utils_video
 
 """
 This script provides a structured way to handle configurations for the video tracking application.
-Configurations are read from a YAML file and are used to define various parameters like video output settings,
-color thresholds for tracking, and more.
+Configurations are read from a YAML file (or a dict, when the tracker is used as a library) and are used to define
+various parameters like video output settings, color thresholds for tracking, and more.
+Once loaded, a configuration is compiled into an immutable `CompiledConfig` with ready-to-use values, and
+`load_config` parses every configuration file only once per process.
 """
 
 
@@ -17,6 +26,7 @@ class Config:
 
     Basic Usage:
         config = Config("path_to_yaml")
+        config = Config.from_dict({<parameter_name>: <value>, ...})
         value = config.get(<parameter_name>)
     """
     # Define output directory
@@ -25,8 +35,11 @@ class Config:
     # Define supported output formats for clarity
     OUTPUT_FORMATS = {"mp4", "avi", "mov"}
 
-    # Define configured scenes
-    CONFIGURED_SCENES = {"glowing_bar_01", "glowing_bar_02"}
+    # Define file with the configured scenes
+    SCENES_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), "../../config_scenes/scenes.yml"))
+
+    # Define the FourCC codes of the output formats
+    FOURCC_CODES = {"avi": "XVID", "mp4": "MP4V", "mov": "MJPG"}
 
     # Define configured values for location_most
     LOCATIONS_MOST = {"left", "right", "top", "bottom"}
@@ -40,23 +53,59 @@ class Config:
                            "show_frame_number", "show_coordinates", "save_data",
                            "text_color", "output_name", "data_file_name"]
 
-    def __init__(self, config_file_path: str):
+    # Define optional parameters with their default values
+    OPTIONAL_PARAMETERS = {"scenes_file": SCENES_FILE, "scene_cache_size": 8,
+                           "pipeline_workers": 0, "pipeline_queue_size": 8,
+                           "data_formats": ["csv"], "data_flush_frames": 100, "data_flush_ms": 1000,
+                           "use_roi": True, "use_search_window": False, "search_window_size": [160, 160],
+                           "search_window_velocity": True, "search_window_fallback": "full_frame",
+                           "metrics": False, "metrics_sinks": ["log"], "metrics_interval_ms": 5000,
+                           "metrics_window": 1000, "metrics_port": 8000,
+                           "multi_target": False, "min_blob_area": 20, "association_distance": 50,
+                           "max_missed_frames": 5,
+                           "livecam_device": 0, "livecam_replay_path": None, "livecam_timeout_ms": 2000,
+                           "livecam_warmup_ms": 5000,
+                           "resize_interpolation": "area", "use_color_lut": False,
+                           "video_output_mode": "encoded", "video_writer_queue_size": 16,
+                           "coarse_width": 0, "refine_patch_size": [64, 64],
+                           "skip_unchanged_frames": False, "frame_change_threshold": 8, "max_skipped_frames": 30,
+                           "use_frame_cache": False, "frame_cache_max_mb": 4096, "batch_frames": 0,
+                           "subpixel": False, "point_filter": None, "filter_alpha": 0.5, "filter_beta": 0.1,
+                           "filter_process_noise": 0.5, "filter_measurement_noise": 1.0}
+
+    def __init__(self, config_file_path: str = None, parameters: dict = None):
         """
-        Initialize the configuration from the provided file path.
+        Initialize the configuration from the provided file path, or from a dict of parameters.
         """
         self.config_file = config_file_path
+        self._parameters = parameters
         self._arguments_dict = {}
+        self._compiled = None
+        self._loaded = False
 
         # Categorize configuration parameters by their expected data type for ease of validation and parsing.
-        self._path_keywords = ["video_input_path"]
+        self._path_keywords = ["video_input_path", "scenes_file", "livecam_replay_path"]
         self._int_keywords = ["output_width", "output_height", "lower_color", "upper_color",
                               "point_color", "point_border_color", "point_radius",
                               "point_border_thickness", "blur_ksize", "output_fps",
-                              "text_color"]
+                              "text_color", "scene_cache_size", "pipeline_workers", "pipeline_queue_size",
+                              "data_flush_frames", "data_flush_ms", "search_window_size",
+                              "metrics_interval_ms", "metrics_window", "metrics_port",
+                              "min_blob_area", "association_distance", "max_missed_frames",
+                              "livecam_device", "livecam_timeout_ms", "livecam_warmup_ms",
+                              "video_writer_queue_size", "coarse_width", "refine_patch_size",
+                              "frame_change_threshold", "max_skipped_frames", "frame_cache_max_mb",
+                              "batch_frames"]
         self._bool_keywords = ["use_livecam", "save_video", "show_video", "show_mask",
-                               "show_frame_number", "show_coordinates", "save_data"]
+                               "show_frame_number", "show_coordinates", "save_data", "use_roi",
+                               "use_search_window", "search_window_velocity", "metrics",
+                               "multi_target", "use_color_lut", "skip_unchanged_frames",
+                               "use_frame_cache", "subpixel"]
+        self._float_keywords = ["filter_alpha", "filter_beta", "filter_process_noise", "filter_measurement_noise"]
         self._str_keywords = ["output_format", "location_most", "scene", "output_name",
-                              "data_file_name"]
+                              "data_file_name", "data_formats", "search_window_fallback",
+                              "metrics_sinks", "resize_interpolation", "video_output_mode",
+                              "point_filter"]
 
         # Load configurations on instantiation.
         self.load()
@@ -67,18 +116,50 @@ class Config:
         """
         with open(self.config_file, 'r') as file:
             yaml_arguments = yaml.safe_load(file)
+        self._load_arguments(yaml_arguments)
 
-        for parameter_name, parameter_value in yaml_arguments.items():
+    def _load_arguments(self, arguments: dict):
+        """
+        Load configurations from a dict of parameters and enforce their constraints.
+        """
+        for parameter_name, parameter_value in arguments.items():
             self.set(parameter_name, parameter_value)
 
+        self._set_optional_parameters()
+        self._load_scenes()
         self._check_constraints()
 
+    def _set_optional_parameters(self):
+        """
+        Set the optional parameters that are not present in the YAML file to their default values.
+        """
+        for parameter_name, default_value in self.OPTIONAL_PARAMETERS.items():
+            if parameter_name not in self._arguments_dict:
+                self.set(parameter_name, default_value)
+
+    def _load_scenes(self):
+        """
+        Load the scene definitions used to modify the mask.
+        """
+        self._arguments_dict["scenes"] = utils_mask.load_scenes(self._arguments_dict.get("scenes_file"))
+
+    @classmethod
+    def from_dict(cls, parameters: dict):
+        """
+        Create a configuration from a dict of parameters instead of a YAML file.
+        """
+        return cls(parameters=parameters)
+
     def load(self):
         """
         Public method to load configurations.
         """
-        self._load_yaml_arguments()
+        if self.config_file is not None:
+            self._load_yaml_arguments()
+        else:
+            self._load_arguments(self._parameters or {})
         self._arguments_dict["output_directory"] = self.OUTPUT_DIRECTORY
+        self._loaded = True
 
     def _check_constraints(self):
         """
@@ -92,6 +173,16 @@ class Config:
         self._check_livecam_inside_docker()
         self._check_show_video_inside_docker()
         self._check_location_most()
+        self._check_data_formats()
+        self._check_multi_target()
+        self._check_search_window()
+        self._check_coarse_to_fine()
+        self._check_skip_unchanged_frames()
+        self._check_batch_frames()
+        self._check_point_estimation()
+        self._check_metrics_sinks()
+        self._check_resize_interpolation()
+        self._check_video_output_mode()
 
     def _check_all_parameters_present(self):
         """
@@ -115,9 +206,10 @@ class Config:
     def _check_scenes(self):
         """
         Validate the camera scene against the configured scenes.
-        If the specified scene is not configured, set to None.
+        If the specified scene is not configured, set to None. No scene (None) leaves the mask unmodified.
         """
-        if self._arguments_dict.get("scene") not in self.CONFIGURED_SCENES:
+        scene = self._arguments_dict.get("scene")
+        if scene is not None and scene not in self._arguments_dict.get("scenes"):
             logging.warning(f"Scene {self._arguments_dict.get('scene')} is not configured.")
             logging.warning("The mask will not be modified based on the specific scene.")
             self._arguments_dict["scene"] = None
@@ -133,12 +225,199 @@ class Config:
                 f"Location most {self._arguments_dict.get('location_most')} is not configured. Defaulting location most to 'left'.")
             self._arguments_dict["location_most"] = "left"
 
+    def _check_data_formats(self):
+        """
+        Validate the data formats against the supported formats.
+        Unsupported formats are ignored and, if none is left, default to 'csv'.
+        """
+        data_formats = self._arguments_dict.get("data_formats")
+        if not isinstance(data_formats, list):
+            data_formats = [data_formats]
+
+        unsupported_formats = [data_format for data_format in data_formats
+                               if data_format not in utils_data.DATA_FORMATS]
+        if unsupported_formats:
+            logging.warning(f"Data formats {', '.join(map(str, unsupported_formats))} are not supported. Ignoring them.")
+
+        data_formats = [data_format for data_format in data_formats if data_format in utils_data.DATA_FORMATS]
+        self._arguments_dict["data_formats"] = data_formats or ["csv"]
+
+    def _check_multi_target(self):
+        """
+        Check constraints related to the multi-target mode.
+        Target IDs depend on the previous frames, so the frames must be processed in order and the whole frame
+        must be searched.
+        """
+        if not self._arguments_dict.get("multi_target"):
+            return
+
+        if self._arguments_dict.get("use_search_window"):
+            logging.warning("Search window is not supported with 'multi_target'. Disabling 'use_search_window'.")
+            self._arguments_dict["use_search_window"] = False
+        if self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported with 'multi_target'. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
+
+    def _check_search_window(self):
+        """
+        Validate the search window configuration.
+        The search window depends on the previous frame, so it cannot be combined with pipeline workers.
+        If the fallback policy is not configured, default to 'full_frame'.
+        """
+        if not self._arguments_dict.get("use_search_window"):
+            return
+
+        if self._arguments_dict.get("search_window_fallback") not in utils_point_track.SearchWindow.FALLBACK_POLICIES:
+            logging.warning(f"Search window fallback {self._arguments_dict.get('search_window_fallback')} "
+                            f"is not configured. Defaulting to 'full_frame'.")
+            self._arguments_dict["search_window_fallback"] = "full_frame"
+
+        if self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported with 'use_search_window'. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
+
+    def _check_coarse_to_fine(self):
+        """
+        Validate the coarse-to-fine detection configuration.
+        The coarse width must be lower than the output width, and the point is only refined on the whole frame,
+        so it cannot be combined with the multi-target mode nor the search window.
+        """
+        if not self._arguments_dict.get("coarse_width"):
+            return
+
+        if self._arguments_dict.get("coarse_width") >= self._arguments_dict.get("output_width"):
+            logging.warning(f"Coarse width {self._arguments_dict.get('coarse_width')} is not lower than the output "
+                            f"width. Disabling coarse-to-fine detection.")
+            self._arguments_dict["coarse_width"] = 0
+            return
+
+        if self._arguments_dict.get("multi_target"):
+            logging.warning("Coarse-to-fine detection is not supported with 'multi_target'. Setting 'coarse_width' "
+                            "to 0.")
+            self._arguments_dict["coarse_width"] = 0
+            return
+
+        if self._arguments_dict.get("use_search_window"):
+            logging.warning("Search window is not supported with 'coarse_width'. Disabling 'use_search_window'.")
+            self._arguments_dict["use_search_window"] = False
+
+    def _check_skip_unchanged_frames(self):
+        """
+        Validate the skipping of unchanged frames.
+        Whether a frame is unchanged depends on the last processed frame, so it cannot be combined with pipeline
+        workers.
+        """
+        if not self._arguments_dict.get("skip_unchanged_frames"):
+            return
+
+        if self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported with 'skip_unchanged_frames'. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
+
+    def _check_batch_frames(self):
+        """
+        Validate the batched processing of the frames.
+        The frames of a batch are processed independently of each other, so it is only supported for video files
+        and cannot be combined with the features that depend on the previous frame, nor with pipeline workers.
+        """
+        if self._arguments_dict.get("batch_frames", 0) <= 1:
+            self._arguments_dict["batch_frames"] = 0
+            return
+
+        for parameter_name in ["use_livecam", "multi_target", "use_search_window", "coarse_width",
+                               "skip_unchanged_frames"]:
+            if self._arguments_dict.get(parameter_name):
+                logging.warning(f"Batched processing is not supported with '{parameter_name}'. "
+                                f"Setting 'batch_frames' to 0.")
+                self._arguments_dict["batch_frames"] = 0
+                return
+
+        if self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported with 'batch_frames'. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
+
+    def _check_point_estimation(self):
+        """
+        Validate the sub-pixel estimation and the temporal filter of the point.
+        They only apply to a single point, and the filter depends on the previous frame, so it cannot be combined
+        with pipeline workers. Invalid filter parameters default to their default values.
+        """
+        if self._arguments_dict.get("point_filter") not in utils_point_track.POINT_FILTERS:
+            logging.warning(f"Point filter {self._arguments_dict.get('point_filter')} is not supported. "
+                            f"Defaulting to None.")
+            self._arguments_dict["point_filter"] = None
+
+        if self._arguments_dict.get("multi_target") and (self._arguments_dict.get("subpixel")
+                                                         or self._arguments_dict.get("point_filter")):
+            logging.warning("Sub-pixel estimation and point filters are not supported with 'multi_target'. "
+                            "Disabling them.")
+            self._arguments_dict["subpixel"] = False
+            self._arguments_dict["point_filter"] = None
+
+        if not self._arguments_dict.get("point_filter"):
+            return
+
+        if self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported with 'point_filter'. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
+
+        valid_ranges = {"filter_alpha": (0, 1), "filter_beta": (0, 1), "filter_process_noise": (0, None),
+                        "filter_measurement_noise": (0, None)}
+        for parameter_name, (lowest, highest) in valid_ranges.items():
+            value = self._arguments_dict.get(parameter_name)
+            if value <= lowest or (highest is not None and value > highest):
+                default_value = self.OPTIONAL_PARAMETERS[parameter_name]
+                logging.warning(f"Invalid value {value} for '{parameter_name}'. Defaulting to {default_value}.")
+                self._arguments_dict[parameter_name] = default_value
+
+    def _check_metrics_sinks(self):
+        """
+        Validate the metrics sinks against the supported sinks.
+        Unsupported sinks are ignored and, if none is left, default to 'log'.
+        """
+        metrics_sinks = self._arguments_dict.get("metrics_sinks")
+        if not isinstance(metrics_sinks, list):
+            metrics_sinks = [metrics_sinks]
+
+        unsupported_sinks = [sink for sink in metrics_sinks if sink not in utils_metrics.METRICS_SINKS]
+        if unsupported_sinks:
+            logging.warning(f"Metrics sinks {', '.join(map(str, unsupported_sinks))} are not supported. Ignoring them.")
+
+        metrics_sinks = [sink for sink in metrics_sinks if sink in utils_metrics.METRICS_SINKS]
+        self._arguments_dict["metrics_sinks"] = metrics_sinks or ["log"]
+
+    def _check_resize_interpolation(self):
+        """
+        Validate the interpolation used to resize the frames.
+        If it is not supported, default to 'area'.
+        """
+        if self._arguments_dict.get("resize_interpolation") not in utils_video.RESIZE_INTERPOLATIONS:
+            logging.warning(f"Resize interpolation {self._arguments_dict.get('resize_interpolation')} is not "
+                            f"supported. Defaulting to 'area'.")
+            self._arguments_dict["resize_interpolation"] = "area"
+
+    def _check_video_output_mode(self):
+        """
+        Validate the output mode of the video against the supported modes.
+        If it is not supported, default to 'encoded'.
+        """
+        if self._arguments_dict.get("video_output_mode") not in utils_video.VIDEO_OUTPUT_MODES:
+            logging.warning(f"Video output mode {self._arguments_dict.get('video_output_mode')} is not supported. "
+                            f"Defaulting to 'encoded'.")
+            self._arguments_dict["video_output_mode"] = "encoded"
+
     def _check_livecam_inside_docker(self):
         """
         Check if the application is running inside a Docker container and if the live camera is being used.
-        If so, disable the live camera as it's not supported inside Docker.
+        If so, disable the live camera as it's not supported inside Docker, unless a video file is replayed instead.
         """
-        if utils_paths.is_inside_docker() and self._arguments_dict.get("use_livecam"):
+        if (utils_paths.is_inside_docker() and self._arguments_dict.get("use_livecam")
+                and not self._arguments_dict.get("livecam_replay_path")):
             logging.warning("Live camera feed is not supported inside a Docker container. Disabling 'use_livecam'.")
             self._arguments_dict["use_livecam"] = False
 
@@ -158,13 +437,58 @@ class Config:
         if self._arguments_dict.get("use_livecam") and self._arguments_dict.get("save_video"):
             logging.warning("Saving video is not supported when 'use_livecam' is set to True. Disabling 'save_video'.")
             self._arguments_dict["save_video"] = False
+        if self._arguments_dict.get("use_livecam") and self._arguments_dict.get("pipeline_workers"):
+            logging.warning("Pipeline processing is not supported when 'use_livecam' is set to True. "
+                            "Setting 'pipeline_workers' to 0.")
+            self._arguments_dict["pipeline_workers"] = 0
 
     def set(self, parameter_name: str, parameter_value=None):
         """
         Set a specific configuration parameter.
+        Once the configuration is loaded, its constraints are enforced again with the new value.
         """
         parameter_value = self._fix_type_and_value_of_non_dict_param(parameter_name, parameter_value)
         self._arguments_dict[parameter_name] = parameter_value
+        self._compiled = None
+        if self._loaded:
+            if parameter_name == "scenes_file":
+                self._load_scenes()
+            self._check_constraints()
+
+    def copy(self):
+        """
+        Return a copy of the configuration whose parameters can be set independently.
+        """
+        config = copy.copy(self)
+        config._arguments_dict = copy.deepcopy(self._arguments_dict)
+        return config
+
+    def __getstate__(self):
+        """
+        Pickle the configuration without its compiled form (its read-only scenes cannot be pickled), which is
+        compiled again when needed, e.g. in the process running a shard or a batch job.
+        """
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
+
+    def compile(self):
+        """
+        Compile the configuration into an immutable CompiledConfig with ready-to-use values: lists become tuples,
+        the scene definitions read-only mappings, the color bounds read-only NumPy arrays and the output format its
+        FourCC code.
+        The compiled configuration is kept until a parameter is set.
+        """
+        if self._compiled is None:
+            values = {name: tuple(value) if isinstance(value, list) else value
+                      for name, value in self._arguments_dict.items() if name in CompiledConfig._fields}
+            values["scenes"] = _read_only(self.get("scenes"))
+            values["lower_bound"] = _read_only_array(self.get("lower_color"))
+            values["upper_bound"] = _read_only_array(self.get("upper_color"))
+            fourcc_code = self.FOURCC_CODES.get(str(self.get("output_format")).lower(), "XVID")
+            values["fourcc"] = cv2.VideoWriter_fourcc(*fourcc_code)
+            self._compiled = CompiledConfig(**values)
+        return self._compiled
 
     def _fix_type_and_value_of_non_dict_param(self, parameter_name, parameter_value):
         """
@@ -193,6 +517,10 @@ class Config:
             else:
                 return int(parameter_value)
 
+        # Float
+        if parameter_name in self._float_keywords:
+            return float(parameter_value)
+
         # Str or list of str
         if parameter_name in self._str_keywords:
             if isinstance(parameter_value, list):
@@ -208,6 +536,49 @@ class Config:
         return self._arguments_dict.get(argument_name)
 
 
+# Compiled configurations are immutable: their fields hold the parameters (lists as tuples, dicts as read-only
+# mappings) and derived values
+CompiledConfig = namedtuple("CompiledConfig", Config.EXPECTED_PARAMETERS + list(Config.OPTIONAL_PARAMETERS)
+                            + ["output_directory", "scenes", "lower_bound", "upper_bound", "fourcc"])
+
+# Loaded configurations, keyed by the hash of their file and the working directory their paths are relative to
+_CONFIG_CACHE = {}
+
+
+def _read_only(value):
+    """
+    Convert the nested dicts and lists of a value to read-only mappings and tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: _read_only(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_read_only(item) for item in value)
+    return value
+
+
+def _read_only_array(values) -> np.ndarray:
+    """
+    Convert values to a read-only uint8 NumPy array.
+    """
+    array = np.array(values, dtype=np.uint8)
+    array.flags.writeable = False
+    return array
+
+
+def load_config(config_file_path: str) -> Config:
+    """
+    Load a configuration from a YAML file, parsing and compiling every file content only once per process.
+    Return a copy whose parameters can be set independently.
+    """
+    with open(config_file_path, 'rb') as file:
+        key = (hashlib.sha256(file.read()).hexdigest(), os.getcwd())
+    config = _CONFIG_CACHE.get(key)
+    if config is None:
+        config = _CONFIG_CACHE[key] = Config(config_file_path)
+        config.compile()
+    return config.copy()
+
+
 def load_config_from_files() -> Config:
     """
     Load configurations from a file provided as a command line argument.
@@ -1,16 +1,210 @@
 import os
+import time
+from array import array
+import numpy as np
 
 """
 Utility functions to work with data.
+The point's coordinates are written by a `CoordinatesWriter` that lives for the whole tracking run and buffers the
+rows, instead of opening the file on every frame. Besides CSV, the coordinates can be saved in a columnar NumPy
+.npz file with int32 columns and a validity mask, which is much faster to load than parsing "N/A" strings.
+In multi-target mode, a `TargetsWriter` writes one row per target per frame in the same formats.
+When unchanged frames are skipped, a `reused` column marks the rows whose result was reused from the last processed
+frame. Sub-pixel or filtered coordinates are saved as floats.
 """
 
+# Supported formats of the data files
+DATA_FORMATS = {"csv", "npz"}
 
-def save_coordinates(frame_number: int, point: tuple, output_directory: str, data_file_name: str) -> None:
+# Header of the .csv files
+CSV_HEADER = "frame_number,x_coordinate,y_coordinate\n"
+
+# Coordinate saved in the .npz files when no point is detected
+MISSING_COORDINATE = -1
+
+# NumPy types of the array typecodes used for the columns
+_COLUMN_DTYPES = {'i': np.int32, 'b': bool, 'd': np.float64}
+
+
+class CoordinatesWriter:
     """
-    Save the point's coordinates to a .csv file.
+    Buffered writer of the point's coordinates.
+    CSV rows are flushed every `flush_frames` frames or `flush_ms` milliseconds and on close.
+    The columnar .npz file is written on close.
+
+    Basic Usage:
+        with CoordinatesWriter(output_directory, data_file_name, ["csv", "npz"]) as writer:
+            writer.write(frame_number, point)
+    With `mark_reused`, a `reused` column (0 or 1 in CSV, bool in .npz) is added to the rows.
+    With `float_coordinates`, the coordinates are written with two decimals in CSV and as float64 in .npz.
     """
-    with open(os.path.join(output_directory, 'data', f'{data_file_name}.csv'), "a") as file:
+    CSV_HEADER = CSV_HEADER
+
+    # Columns of the .npz file and their array typecodes
+    COLUMNS = {"frame_number": 'i', "x": 'i', "y": 'i', "valid": 'b'}
+
+    def __init__(self, output_directory: str, data_file_name: str, data_formats=("csv",),
+                 flush_frames: int = 100, flush_ms: int = 1000, mark_reused: bool = False,
+                 float_coordinates: bool = False):
+        """
+        Initialize the writer, clearing the .csv file and writing its header.
+        """
+        self._base_path = os.path.join(output_directory, 'data', data_file_name)
+        self._formats = set(data_formats)
+        self._flush_frames = max(1, flush_frames)
+        self._flush_seconds = flush_ms / 1000
+        self._mark_reused = mark_reused
+        self._float_coordinates = float_coordinates
+
+        # Pending .csv rows and columns of the .npz file
+        self._rows = []
+        self._frames_since_flush = 0
+        self._columns = {name: array(typecode) for name, typecode in self.COLUMNS.items()}
+        if mark_reused:
+            self._columns["reused"] = array('b')
+        if float_coordinates:
+            self._columns["x"], self._columns["y"] = array('d'), array('d')
+        self._last_flush = time.monotonic()
+
+        self._csv_file = None
+        if "csv" in self._formats:
+            self._csv_file = open(f"{self._base_path}.csv", "w")
+            self._csv_file.write(self.CSV_HEADER.replace("\n", ",reused\n") if mark_reused else self.CSV_HEADER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _csv_rows(self, frame_number: int, point: tuple or None) -> list:
+        """
+        Format the .csv rows of a frame.
+        """
         if point is None:
-            file.write(f"{frame_number},N/A,N/A\n")
-        else:
-            file.write(f"{frame_number},{point[0]},{point[1]}\n")
+            return [f"{frame_number},N/A,N/A\n"]
+        if self._float_coordinates:
+            return [f"{frame_number},{point[0]:.2f},{point[1]:.2f}\n"]
+        return [f"{frame_number},{point[0]},{point[1]}\n"]
+
+    def _append_columns(self, frame_number: int, point: tuple or None) -> None:
+        """
+        Append the values of a frame to the columns of the .npz file.
+        """
+        self._columns["frame_number"].append(frame_number)
+        self._columns["x"].append(MISSING_COORDINATE if point is None else point[0])
+        self._columns["y"].append(MISSING_COORDINATE if point is None else point[1])
+        self._columns["valid"].append(point is not None)
+
+    def write(self, frame_number: int, point: tuple or None, reused: bool = False) -> None:
+        """
+        Buffer the point's coordinates of a frame, marked as reused from the last processed frame if configured.
+        """
+        if self._csv_file:
+            rows = self._csv_rows(frame_number, point)
+            if self._mark_reused:
+                rows = [f"{row[:-1]},{int(reused)}\n" for row in rows]
+            self._rows.extend(rows)
+            self._frames_since_flush += 1
+            if (self._frames_since_flush >= self._flush_frames
+                    or time.monotonic() - self._last_flush >= self._flush_seconds):
+                self.flush()
+
+        if "npz" in self._formats:
+            row_count = len(self._columns["frame_number"])
+            self._append_columns(frame_number, point)
+            if self._mark_reused:
+                self._columns["reused"].extend([reused] * (len(self._columns["frame_number"]) - row_count))
+
+    def flush(self) -> None:
+        """
+        Write the buffered CSV rows to the file.
+        """
+        if self._csv_file and self._rows:
+            self._csv_file.write("".join(self._rows))
+            self._csv_file.flush()
+            self._rows.clear()
+        self._frames_since_flush = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Flush the buffered rows, write the columnar file and close the files.
+        """
+        if self._csv_file:
+            self.flush()
+            self._csv_file.close()
+            self._csv_file = None
+
+        if "npz" in self._formats:
+            save_columns_npz(f"{self._base_path}.npz",
+                             {name: np.frombuffer(column, dtype=np.dtype(column.typecode)).astype(
+                                 _COLUMN_DTYPES[column.typecode]) for name, column in self._columns.items()})
+            self._formats.discard("npz")
+
+
+class TargetsWriter(CoordinatesWriter):
+    """
+    Buffered writer of the targets of the multi-target mode, with one row per target per frame.
+    Frames without targets have no rows.
+    """
+    CSV_HEADER = "frame_number,target_id,x_coordinate,y_coordinate,centroid_x,centroid_y,area\n"
+    COLUMNS = {"frame_number": 'i', "target_id": 'i', "x": 'i', "y": 'i',
+               "centroid_x": 'd', "centroid_y": 'd', "area": 'i'}
+
+    def _csv_rows(self, frame_number: int, targets: list) -> list:
+        return [f"{frame_number},{target.target_id},{target.point[0]},{target.point[1]},"
+                f"{target.centroid[0]:.2f},{target.centroid[1]:.2f},{target.area}\n" for target in targets]
+
+    def _append_columns(self, frame_number: int, targets: list) -> None:
+        for target in targets:
+            self._columns["frame_number"].append(frame_number)
+            self._columns["target_id"].append(target.target_id)
+            self._columns["x"].append(int(target.point[0]))
+            self._columns["y"].append(int(target.point[1]))
+            self._columns["centroid_x"].append(float(target.centroid[0]))
+            self._columns["centroid_y"].append(float(target.centroid[1]))
+            self._columns["area"].append(int(target.area))
+
+
+def save_columns_npz(path: str, columns: dict) -> None:
+    """
+    Save columns of data to a .npz file.
+    """
+    np.savez(path, **columns)
+
+
+def load_coordinates_npz(path: str) -> dict:
+    """
+    Load the point's coordinates (or targets) saved in a .npz file as a dict of columns.
+    """
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def concatenate_coordinates(output_directory: str, part_file_names: list, data_file_name: str,
+                            data_formats=("csv",), remove_parts: bool = True) -> None:
+    """
+    Concatenate the data files of several parts of a video in order, keeping a single CSV header.
+    """
+    base_path = os.path.join(output_directory, 'data', data_file_name)
+    part_paths = [os.path.join(output_directory, 'data', part_file_name) for part_file_name in part_file_names]
+
+    if "csv" in data_formats:
+        with open(f"{base_path}.csv", "w") as file:
+            for part_number, part_path in enumerate(part_paths):
+                with open(f"{part_path}.csv", "r") as part_file:
+                    header = next(part_file)
+                    if part_number == 0:
+                        file.write(header)
+                    file.writelines(part_file)
+
+    if "npz" in data_formats:
+        parts = [load_coordinates_npz(f"{part_path}.npz") for part_path in part_paths]
+        save_columns_npz(f"{base_path}.npz", {name: np.concatenate([part[name] for part in parts])
+                                              for name in parts[0]})
+
+    if remove_parts:
+        for part_path in part_paths:
+            for data_format in data_formats:
+                os.remove(f"{part_path}.{data_format}")
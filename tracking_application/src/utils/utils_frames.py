@@ -0,0 +1,229 @@
+import cv2
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from . import utils_video
+
+"""
+Utility functions to cache the decoded frames of video files.
+The frames of a video, resized to the output width, are decoded once into a raw file on disk and read back
+zero-copy through a memory map on the next runs, instead of decoding and resizing the video again. The cached
+videos are keyed by the hash of the video file and the resize parameters, and the least recently used ones are
+evicted when the cache exceeds its maximum size.
+`CachedVideoCapture` reads the cached frames with the interface of cv2.VideoCapture, so the tracking uses either
+frame source transparently. Its frames are read-only views of the memory map.
+"""
+
+# Directory of the cached frames
+FRAME_CACHE_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(__file__), "../../cache/frames"))
+
+
+def file_hash(path: str) -> str:
+    """
+    Compute the SHA-256 hash of a file, reading it by chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(video_path: str, width: int, interpolation: str) -> str:
+    """
+    Get the key of the cached frames of a video resized to the given width.
+    """
+    return f"{file_hash(video_path)[:32]}_{width}_{interpolation}"
+
+
+class CachedVideoCapture:
+    """
+    Reads the cached frames of a video through a memory map, with the interface of cv2.VideoCapture used by the
+    tracking (isOpened, read, get, set and release). Consecutive frames can also be read at once with read_frames.
+
+    Basic Usage:
+        vs = CachedVideoCapture(raw_path, metadata)
+        grabbed, frame = vs.read()
+        vs.release()
+    """
+
+    def __init__(self, raw_path: str, metadata: dict):
+        """
+        Map the raw frames described by the metadata.
+        """
+        self._metadata = metadata
+        shape = (metadata["frame_count"], metadata["height"], metadata["width"], metadata["channels"])
+        self._frames = np.memmap(raw_path, dtype=np.uint8, mode="r", shape=shape)
+        self._position = 0
+
+    def isOpened(self) -> bool:
+        """
+        Check if the frames are mapped.
+        """
+        return self._frames is not None
+
+    def read(self) -> tuple:
+        """
+        Return (True, frame) for the next frame, or (False, None) at the end of the video.
+        """
+        if self._frames is None or self._position >= len(self._frames):
+            return False, None
+        frame = self._frames[self._position]
+        self._position += 1
+        return True, frame
+
+    def read_frames(self, count: int) -> np.ndarray:
+        """
+        Return the next frames (at most `count`) as a read-only view of shape (count, height, width, channels).
+        """
+        if self._frames is None:
+            return self._frames
+        frames = self._frames[self._position:self._position + count]
+        self._position += len(frames)
+        return frames
+
+    def get(self, property_id: int) -> float:
+        """
+        Get a property of the video (position, frame count, frame rate or frame size).
+        """
+        properties = {cv2.CAP_PROP_POS_FRAMES: self._position,
+                      cv2.CAP_PROP_FRAME_COUNT: self._metadata["frame_count"],
+                      cv2.CAP_PROP_FPS: self._metadata["fps"],
+                      cv2.CAP_PROP_FRAME_WIDTH: self._metadata["width"],
+                      cv2.CAP_PROP_FRAME_HEIGHT: self._metadata["height"]}
+        return float(properties.get(property_id, 0))
+
+    def set(self, property_id: int, value: float) -> bool:
+        """
+        Seek to a frame. Other properties cannot be set.
+        """
+        if property_id != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._position = min(max(0, int(value)), self._metadata["frame_count"])
+        return True
+
+    def release(self) -> None:
+        """
+        Unmap the frames.
+        """
+        self._frames = None
+
+
+def _entry_paths(directory: str, key: str) -> tuple:
+    """
+    Get the paths of the raw frames and metadata of a cache entry.
+    """
+    return os.path.join(directory, f"{key}.raw"), os.path.join(directory, f"{key}.json")
+
+
+def _build_entry(video_path: str, width: int, interpolation: str, directory: str, key: str,
+                 max_bytes: int) -> bool:
+    """
+    Decode the frames of the video resized to the given width into a cache entry.
+    Return False if the video can't be decoded or its frames would exceed the maximum size of the cache.
+    """
+    raw_path, metadata_path = _entry_paths(directory, key)
+    vs = cv2.VideoCapture(video_path)
+    if not vs.isOpened():
+        return False
+    rows, columns = int(vs.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(vs.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_width, frame_height = utils_video.resized_size(rows, columns, width)
+    estimated_bytes = int(vs.get(cv2.CAP_PROP_FRAME_COUNT)) * frame_width * frame_height * 3
+    if estimated_bytes > max_bytes:
+        logging.warning(f"The frames of {video_path} ({estimated_bytes / 2 ** 20:.0f} MB) exceed the maximum size "
+                        f"of the frame cache. Decoding the video instead.")
+        vs.release()
+        return False
+
+    logging.info(f"Decoding {video_path} into the frame cache...")
+    os.makedirs(directory, exist_ok=True)
+
+    # Write to temporary files first, so concurrent runs never read a partial entry
+    temporary_raw_path = f"{raw_path}.{os.getpid()}.tmp"
+    frame_count, frame_shape = 0, None
+    with open(temporary_raw_path, "wb") as file:
+        grabbed, frame = vs.read()
+        while grabbed:
+            frame = utils_video.resize_frame(frame, width, interpolation)
+            frame_shape = frame_shape or frame.shape
+            file.write(np.ascontiguousarray(frame).data)
+            frame_count += 1
+            grabbed, frame = vs.read()
+    fps = vs.get(cv2.CAP_PROP_FPS)
+    vs.release()
+    if not frame_count:
+        os.remove(temporary_raw_path)
+        return False
+
+    metadata = {"source": os.path.abspath(video_path), "frame_count": frame_count, "height": frame_shape[0],
+                "width": frame_shape[1], "channels": frame_shape[2] if len(frame_shape) == 3 else 1, "fps": fps}
+    temporary_metadata_path = f"{metadata_path}.{os.getpid()}.tmp"
+    with open(temporary_metadata_path, "w") as file:
+        json.dump(metadata, file)
+    os.replace(temporary_raw_path, raw_path)
+    os.replace(temporary_metadata_path, metadata_path)
+    return True
+
+
+def evict(directory: str, max_bytes: int, keep: str = None) -> None:
+    """
+    Remove the least recently used cache entries (but the one to keep) until the cache fits in the maximum size.
+    """
+    entries = []
+    for file_name in os.listdir(directory):
+        key, extension = os.path.splitext(file_name)
+        if extension != ".json":
+            continue
+        raw_path, metadata_path = _entry_paths(directory, key)
+        try:
+            entries.append((os.path.getmtime(metadata_path), key,
+                            os.path.getsize(raw_path) + os.path.getsize(metadata_path)))
+        except OSError:
+            continue
+
+    total_bytes = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if key == keep:
+            continue
+        for path in _entry_paths(directory, key):
+            if os.path.exists(path):
+                os.remove(path)
+        total_bytes -= size
+        logging.info(f"Evicted {key} from the frame cache.")
+
+
+def open_frame_cache(video_path: str, width: int, interpolation: str, max_mb: int, build: bool = True,
+                     directory: str = FRAME_CACHE_DIRECTORY) -> CachedVideoCapture or None:
+    """
+    Open the cached frames of the video resized to the given width, decoding them into the cache first if they are
+    not cached and `build` is True.
+    Return None if the frames are not cached.
+    """
+    key = cache_key(video_path, width, interpolation)
+    raw_path, metadata_path = _entry_paths(directory, key)
+    max_bytes = max_mb * 2 ** 20
+    if not os.path.exists(metadata_path):
+        try:
+            if not build or not _build_entry(video_path, width, interpolation, directory, key, max_bytes):
+                return None
+        except OSError as e:
+            logging.warning(f"The frames of {video_path} couldn't be cached in {directory}: {e}")
+            return None
+        evict(directory, max_bytes, keep=key)
+
+    try:
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+        vs = CachedVideoCapture(raw_path, metadata)
+        # Mark the entry as recently used
+        os.utime(metadata_path)
+    except (OSError, ValueError) as e:
+        # The entry was evicted by a concurrent run
+        logging.warning(f"The cached frames of {video_path} couldn't be read: {e}")
+        return None
+    logging.info(f"Reading the frames of {video_path} from the frame cache.")
+    return vs
@@ -1,56 +1,148 @@
+import cv2
+import threading
+import yaml
+import numpy as np
+from collections import OrderedDict
+
 """
 This module provides functions to modify masks based on specific scenes or conditions.
+Scenes are declared as data (half-plane inequalities or polygons) in a YAML file and compiled once per
+(scene, width, height) into a boolean region, which is then applied to each frame in a single array operation.
 The primary function, `modify_mask`, determines the scene and applies the appropriate mask modification.
 """
 
+# Comparison operators available for the half-plane inequalities
+HALF_PLANE_OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
 
-def modify_mask(mask, scene):
+def load_scenes(scenes_file_path: str) -> dict:
     """
-    Modify the mask based on specific conditions.
+    Load the scene definitions from the provided YAML file.
     """
-    if scene == "glowing_bar_01":
-        return modify_mask_glowing_bar_scene_01(mask)
-    elif scene == "glowing_bar_02":
-        return modify_mask_glowing_bar_scene_02(mask)
-    else:
-        return mask
+    with open(scenes_file_path, 'r') as file:
+        scenes = yaml.safe_load(file)
+    return scenes or {}
 
 
-def modify_mask_glowing_bar_scene_01(mask):
+def compile_scene_region(scene_definition: dict, rows: int, columns: int) -> np.ndarray:
     """
-    Modify the mask based on specific scene of the glowing bar coming out of the oven.
-    WARNING! THIS FUNCTION MASKS THE INPUT BASED ON THE REGION OF THIS PARTICULAR SCENE
-    FOR DIFFERENT SCENE, CREATE A NEW FUNCTION
+    Compile a scene definition into a boolean region of the given size.
+    The region is the union of all the regions of the scene; pixels inside it are covered by the mask value.
     """
-    # Constants used for mask modification to cover areas of non-interest
-    mask_value = 150
-    mask_ratio = 0.9
-    mask_offset = 0.03
+    region = np.zeros((rows, columns), dtype=bool)
+    for region_definition in scene_definition.get("regions", []):
+        if "half_planes" in region_definition:
+            region |= _compile_half_planes(region_definition["half_planes"], rows, columns)
+        elif "polygon" in region_definition:
+            region |= _compile_polygon(region_definition["polygon"], rows, columns)
+        else:
+            raise ValueError(f"Scene region must define 'half_planes' or 'polygon': {region_definition}")
+    return region
 
-    rows, columns = mask.shape
-    for row in range(rows):
-        for column in range(columns):
-            if row / rows > column / columns * mask_ratio - mask_offset:
-                mask[row, column] = mask_value
 
-    return mask
+def compile_scene_roi(region: np.ndarray) -> tuple:
+    """
+    Compute the bounding box (top, bottom, left, right) of the pixels not covered by the region of a scene.
+    Only this area of the frame needs to be processed; the box is empty if the region covers the whole frame.
+    """
+    rows_of_interest = np.flatnonzero(~region.all(axis=1))
+    columns_of_interest = np.flatnonzero(~region.all(axis=0))
+    if len(rows_of_interest) == 0:
+        return 0, 0, 0, 0
+    return (int(rows_of_interest[0]), int(rows_of_interest[-1]) + 1,
+            int(columns_of_interest[0]), int(columns_of_interest[-1]) + 1)
+
+
+def _compile_half_planes(half_planes: list, rows: int, columns: int) -> np.ndarray:
+    """
+    Compile the intersection of half-planes 'row / rows <op> column / columns * ratio - offset'.
+    The float arithmetic is evaluated in the same order as the original per-pixel loops,
+    so the compiled region is bit-identical to them.
+    """
+    row_ratios = (np.arange(rows) / rows)[:, np.newaxis]
+    column_ratios = np.arange(columns) / columns
+
+    region = np.ones((rows, columns), dtype=bool)
+    for half_plane in half_planes:
+        compare = HALF_PLANE_OPERATORS[half_plane["op"]]
+        region &= compare(row_ratios, column_ratios * half_plane["ratio"] - half_plane["offset"])
+    return region
+
+
+def _compile_polygon(polygon: list, rows: int, columns: int) -> np.ndarray:
+    """
+    Compile a polygon given by [x, y] vertices in normalized coordinates (0 to 1).
+    """
+    vertices = np.array([[round(x * columns), round(y * rows)] for x, y in polygon], dtype=np.int32)
+    region = np.zeros((rows, columns), dtype=np.uint8)
+    cv2.fillPoly(region, [vertices], 1)
+    return region.astype(bool)
 
 
-def modify_mask_glowing_bar_scene_02(mask):
+class SceneMaskCache:
     """
-    Modify the mask based on specific scene of the glowing bar coming out of the oven.
-    WARNING! THIS FUNCTION MASKS THE INPUT BASED ON THE REGION OF THIS PARTICULAR SCENE
-    FOR DIFFERENT SCENE, CREATE A NEW FUNCTION
+    Keeps the compiled scene regions and their regions of interest, keyed by (scene, rows, columns).
+    The least recently used region is evicted when the cache is full. The cache is thread-safe.
     """
-    # Constants used for mask modification to cover areas of non-interest
-    mask_value = 150
-    mask_ratio = 3.5
-    mask_offset = 1
 
-    rows, columns = mask.shape
-    for row in range(rows):
-        for column in range(columns):
-            if row / rows < column / columns * mask_ratio - mask_offset:
-                mask[row, column] = mask_value
+    def __init__(self, scenes: dict, max_size: int = 8):
+        """
+        Initialize the cache with the scene definitions.
+        """
+        self._scenes = scenes or {}
+        self._max_size = max(1, max_size)
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_compiled(self, scene: str, rows: int, columns: int) -> tuple or None:
+        """
+        Retrieve the compiled (region, roi) of the scene for the given size, compiling it if needed.
+        """
+        if scene not in self._scenes:
+            return None
+
+        key = (scene, rows, columns)
+        with self._lock:
+            if key in self._regions:
+                self._regions.move_to_end(key)
+                return self._regions[key]
+
+            region = compile_scene_region(self._scenes[scene], rows, columns)
+            self._regions[key] = (region, compile_scene_roi(region))
+            if len(self._regions) > self._max_size:
+                self._regions.popitem(last=False)
+            return self._regions[key]
+
+    def get(self, scene: str, rows: int, columns: int) -> np.ndarray or None:
+        """
+        Retrieve the compiled region of the scene for the given size.
+        """
+        compiled = self._get_compiled(scene, rows, columns)
+        return compiled[0] if compiled else None
+
+    def roi(self, scene: str, rows: int, columns: int) -> tuple or None:
+        """
+        Retrieve the region of interest (top, bottom, left, right) of the scene for the given size.
+        """
+        compiled = self._get_compiled(scene, rows, columns)
+        return compiled[1] if compiled else None
+
+    def mask_value(self, scene: str) -> int:
+        """
+        Retrieve the value used to cover the region of the scene, or 0 if the scene is not configured.
+        """
+        if scene not in self._scenes:
+            return 0
+        return int(self._scenes[scene].get("mask_value", 150))
+
+
+def modify_mask(mask, scene, scene_masks: SceneMaskCache):
+    """
+    Modify the mask (or a stack of masks) based on the region of the specific scene.
+    """
+    region = scene_masks.get(scene, *mask.shape[-2:])
+    if region is None:
+        return mask
 
+    np.copyto(mask, scene_masks.mask_value(scene), where=region)
     return mask
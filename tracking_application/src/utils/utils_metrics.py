@@ -0,0 +1,252 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from . import utils_timing
+
+"""
+Utility functions to monitor the tracking in production.
+`MetricsTimer` has the same interface as the timers of `utils_timing`; it keeps a rolling histogram per stage and
+periodically reports them to pluggable sinks:
+    - "log": one log line per report.
+    - "jsonl": one JSON line per report appended to a file.
+    - "prometheus": a local HTTP endpoint serving the histograms in the Prometheus text format.
+When the metrics are disabled, the tracker uses `utils_timing.NullTimer` and the instrumentation costs almost nothing.
+"""
+
+# Supported metrics sinks
+METRICS_SINKS = {"log", "jsonl", "prometheus"}
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class RollingHistogram:
+    """
+    Histogram of the durations of a stage.
+    Percentiles are computed over the last `window` durations; bucket counts, count and sum are cumulative.
+    """
+
+    def __init__(self, window: int = 1000):
+        """
+        Initialize an empty histogram.
+        """
+        self.samples = deque(maxlen=max(1, window))
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, duration: float) -> None:
+        """
+        Add a duration in seconds to the histogram.
+        """
+        self.samples.append(duration)
+        self.bucket_counts[bisect.bisect_left(BUCKETS, duration)] += 1
+        self.count += 1
+        self.sum += duration
+
+    def snapshot(self) -> dict:
+        """
+        Summarize the durations of the rolling window in milliseconds.
+        """
+        return utils_timing.summarize_durations(list(self.samples))
+
+
+class MetricsTimer(utils_timing.NullTimer):
+    """
+    Timer that keeps rolling histograms of the stages and reports them to sinks every `interval_ms` milliseconds.
+    """
+    enabled = True
+
+    def __init__(self, sinks: list, interval_ms: int = 5000, window: int = 1000):
+        """
+        Initialize the timer and start its sinks.
+        """
+        self.histograms = {}
+        self.sinks = sinks
+        self.frames_total = 0
+        self._window = window
+        self._interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._frames_since_report = 0
+        self._last_report = time.perf_counter()
+        for sink in self.sinks:
+            sink.start(self)
+
+    def start(self) -> float:
+        """
+        Return the timestamp at which a stage starts.
+        """
+        return time.perf_counter()
+
+    def stop(self, stage: str, start: float) -> float:
+        """
+        Record the duration of a stage that started at the given timestamp and return the current timestamp.
+        The metrics are reported when a frame is completed and the report interval has elapsed.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = RollingHistogram(self._window)
+            histogram.add(now - start)
+            if stage == "frame":
+                self.frames_total += 1
+                self._frames_since_report += 1
+        if stage == "frame" and now - self._last_report >= self._interval:
+            self.report()
+        return now
+
+    def start_run(self) -> None:
+        """
+        Start the first report interval when the processing of the frames starts.
+        """
+        with self._lock:
+            self._frames_since_report = 0
+            self._last_report = time.perf_counter()
+
+    def stop_run(self, frame_count: int) -> None:
+        """
+        Report the last metrics and close the sinks at the end of the tracking.
+        """
+        self.report()
+        for sink in self.sinks:
+            sink.close()
+
+    def report(self) -> None:
+        """
+        Send a snapshot of the metrics to the sinks.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            elapsed = now - self._last_report
+            snapshot = {
+                "timestamp": time.time(),
+                "frames_total": self.frames_total,
+                "fps": round(self._frames_since_report / elapsed, 2) if elapsed > 0 else 0.0,
+                "stages": {stage: histogram.snapshot() for stage, histogram in self.histograms.items()},
+            }
+            self._frames_since_report = 0
+            self._last_report = now
+        for sink in self.sinks:
+            sink.emit(snapshot)
+
+    def prometheus_text(self) -> str:
+        """
+        Render the histograms in the Prometheus text exposition format.
+        """
+        lines = ["# HELP tracking_stage_seconds Duration of the stages of the tracking.",
+                 "# TYPE tracking_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float("inf"),), histogram.bucket_counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'tracking_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'tracking_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'tracking_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines += ["# HELP tracking_frames_total Number of tracked frames.",
+                      "# TYPE tracking_frames_total counter",
+                      f"tracking_frames_total {self.frames_total}"]
+        return "\n".join(lines) + "\n"
+
+
+class LogSink:
+    """
+    Sink that logs one line per report with the fps and the median duration of every stage.
+    """
+
+    def start(self, metrics: MetricsTimer) -> None:
+        pass
+
+    def emit(self, snapshot: dict) -> None:
+        stages = ", ".join(f"{stage} {summary['p50']:.2f}" for stage, summary in snapshot["stages"].items()
+                           if summary.get("calls"))
+        logging.info(f"Metrics: {snapshot['fps']} fps, {snapshot['frames_total']} frames | p50 ms: {stages}")
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesSink:
+    """
+    Sink that appends one JSON line per report to a file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def start(self, metrics: MetricsTimer) -> None:
+        self._file = open(self.path, "a")
+
+    def emit(self, snapshot: dict) -> None:
+        self._file.write(json.dumps(snapshot) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class PrometheusSink:
+    """
+    Sink that serves the metrics in the Prometheus text format on a local HTTP endpoint (http://127.0.0.1:<port>/).
+    """
+
+    def __init__(self, port: int):
+        self.port = port
+        self._server = None
+
+    def start(self, metrics: MetricsTimer) -> None:
+        # Imported here, so the HTTP server is only loaded when the endpoint is used
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        except OSError as e:
+            logging.warning(f"Metrics endpoint couldn't listen on port {self.port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"Metrics endpoint listening on http://127.0.0.1:{self.port}/")
+
+    def emit(self, snapshot: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def create_metrics_timer(sink_names: list, interval_ms: int, window: int, jsonl_path: str,
+                         port: int) -> MetricsTimer:
+    """
+    Create a metrics timer with the sinks of the given names.
+    """
+    sinks = []
+    for sink_name in sink_names:
+        if sink_name == "log":
+            sinks.append(LogSink())
+        elif sink_name == "jsonl":
+            sinks.append(JsonLinesSink(jsonl_path))
+        elif sink_name == "prometheus":
+            sinks.append(PrometheusSink(port))
+    return MetricsTimer(sinks, interval_ms, window)
@@ -0,0 +1,109 @@
+import queue
+import threading
+
+"""
+Utility functions to run the tracking as a pipeline of threads.
+A reader thread decodes the frames, one or more worker threads process them and the calling thread
+outputs the results in frame order. The stages are connected with bounded queues, so decoding, processing
+and encoding overlap (OpenCV releases the GIL) while memory usage stays bounded.
+"""
+
+# Marker sent through the queues when a stage has finished
+_END = object()
+
+# Time in seconds to wait on a queue before checking if the pipeline has been stopped
+_POLL_TIMEOUT = 0.1
+
+
+def _put(stage_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Put an item in the queue, waiting for free space unless the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=_POLL_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(stage_queue: queue.Queue, stop: threading.Event):
+    """
+    Get an item from the queue, waiting for it unless the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=_POLL_TIMEOUT)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(frames, process_frame, output_frame, workers: int = 1, queue_size: int = 8) -> int:
+    """
+    Process the (frame_number, frame) pairs of an iterable with the given number of worker threads.
+    - process_frame(frame) is called in the worker threads and returns the result of the frame.
+    - output_frame(frame_number, result) is called in the calling thread, in the order of the iterable (the frame
+      numbers may skip dropped frames), and returns False to stop the pipeline.
+    Return the number of frames that have been output.
+    """
+    workers = max(1, workers)
+    frames_queue = queue.Queue(maxsize=max(1, queue_size))
+    results_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+
+    def read():
+        try:
+            for index, (frame_number, frame) in enumerate(frames):
+                if not _put(frames_queue, (index, frame_number, frame, None), stop):
+                    return
+        except Exception as error:
+            _put(frames_queue, (0, 0, None, error), stop)
+        for _ in range(workers):
+            _put(frames_queue, _END, stop)
+
+    def work():
+        while True:
+            item = _get(frames_queue, stop)
+            if item is _END:
+                _put(results_queue, _END, stop)
+                return
+            index, frame_number, frame, error = item
+            if error is None:
+                try:
+                    frame = process_frame(frame)
+                except Exception as process_error:
+                    error = process_error
+            _put(results_queue, (index, frame_number, frame, error), stop)
+
+    threads = [threading.Thread(target=read, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        pending = {}
+        next_index = 0
+        finished_workers = 0
+        while finished_workers < workers:
+            item = results_queue.get()
+            if item is _END:
+                finished_workers += 1
+                continue
+
+            index, frame_number, result, error = item
+            if error is not None:
+                raise error
+
+            # Output the results in frame order, keeping the ones that arrive early
+            pending[index] = (frame_number, result)
+            while next_index in pending:
+                if not output_frame(*pending.pop(next_index)):
+                    return next_index + 1
+                next_index += 1
+        return next_index
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -1,9 +1,22 @@
+import cv2
 import numpy as np
+from collections import namedtuple
 
 """
 Utility functions to detect the point of interest.
+The extreme points are found with row- or column-wise reductions of the mask, so no memory
+proportional to the lit area is allocated.
+In multi-target mode, the blobs of the mask are labelled in a single pass and associated across frames.
+The point can be refined to a sub-pixel position from the blurred profile across the edge, and smoothed over time by
+an alpha-beta or Kalman filter, both at a constant cost per frame.
 """
 
+# Supported temporal filters of the point
+POINT_FILTERS = {None, "alpha_beta", "kalman"}
+
+# Step (dx, dy) from the detected point to its neighbour outside the edge, for every location
+OUTWARD_STEPS = {"left": (-1, 0), "right": (1, 0), "top": (0, -1), "bottom": (0, 1)}
+
 
 def detect_point(mask: np.ndarray, location_most: str) -> tuple or None:
     """
@@ -21,45 +34,417 @@ def detect_point(mask: np.ndarray, location_most: str) -> tuple or None:
         return None
 
 
+def _first_index(values: np.ndarray, value: int = 255) -> int:
+    """
+    Return the index of the first element equal to the value, or -1 if there is none.
+    """
+    index = int(np.argmax(values == value))
+    return index if values[index] == value else -1
+
+
+def _last_index(values: np.ndarray, value: int = 255) -> int:
+    """
+    Return the index of the last element equal to the value, or -1 if there is none.
+    """
+    index = _first_index(values[::-1], value)
+    return len(values) - 1 - index if index >= 0 else -1
+
+
 def detect_leftmost_point(mask: np.ndarray) -> tuple or None:
     """
     Detect the leftmost point in the mask with a value of 255.
+    Ties are broken by the topmost row, as in a row-major scan of the mask.
     """
-    if mask.max() == 255:
-        points = np.argwhere(mask == 255)
-        leftmost_point = points[np.argmin(points[:, 1])]
-        return tuple(leftmost_point[::-1])
-    return None
+    column = _first_index(mask.max(axis=0))
+    if column < 0:
+        return None
+    return column, _first_index(mask[:, column])
 
 
 def detect_rightmost_point(mask: np.ndarray) -> tuple or None:
     """
     Detect the rightmost point in the mask with a value of 255.
+    Ties are broken by the topmost row, as in a row-major scan of the mask.
     """
-    if mask.max() == 255:
-        points = np.argwhere(mask == 255)
-        rightmost_point = points[np.argmax(points[:, 1])]
-        return tuple(rightmost_point[::-1])
-    return None
+    column = _last_index(mask.max(axis=0))
+    if column < 0:
+        return None
+    return column, _first_index(mask[:, column])
 
 
 def detect_topmost_point(mask: np.ndarray) -> tuple or None:
     """
     Detect the topmost point in the mask with a value of 255.
+    Ties are broken by the leftmost column, as in a row-major scan of the mask.
     """
-    if mask.max() == 255:
-        points = np.argwhere(mask == 255)
-        topmost_point = points[np.argmin(points[:, 0])]
-        return tuple(topmost_point[::-1])
-    return None
+    row = _first_index(mask.max(axis=1))
+    if row < 0:
+        return None
+    return _first_index(mask[row]), row
 
 
 def detect_bottommost_point(mask: np.ndarray) -> tuple or None:
     """
     Detect the bottommost point in the mask with a value of 255.
+    Ties are broken by the leftmost column, as in a row-major scan of the mask.
+    """
+    row = _last_index(mask.max(axis=1))
+    if row < 0:
+        return None
+    return _first_index(mask[row]), row
+
+
+def detect_points(masks: np.ndarray, location_most: str) -> list:
+    """
+    Detect the point of interest in every mask of a stack of shape (K, H, W), with the reductions of detect_point
+    computed on the whole stack at once.
+    Return the list of the K points (None where no point is detected).
+    """
+    if location_most not in ("left", "right", "top", "bottom"):
+        return [None] * len(masks)
+
+    # Whether every column (or row) of every mask has a point
+    along_columns = location_most in ("left", "right")
+    lit = masks.max(axis=1 if along_columns else 2) == 255
+    if location_most in ("left", "top"):
+        extremes = lit.argmax(axis=1)
+    else:
+        extremes = lit.shape[1] - 1 - lit[:, ::-1].argmax(axis=1)
+    indices = np.arange(len(masks))
+    found = lit[indices, extremes]
+
+    # Ties are broken by the first point of the extreme column (or row), as in detect_point
+    lines = masks[indices, :, extremes] if along_columns else masks[indices, extremes]
+    positions = (lines == 255).argmax(axis=1)
+    if along_columns:
+        return [(int(x), int(y)) if point_found else None for x, y, point_found in zip(extremes, positions, found)]
+    return [(int(x), int(y)) if point_found else None for x, y, point_found in zip(positions, extremes, found)]
+
+
+def extend_window(window: tuple, point: tuple, location_most: str, size: tuple, rows: int, columns: int) -> tuple:
+    """
+    Extend the window (top, bottom, left, right) by the given (width, height) on the sides where the extreme point
+    detected in it could continue outside of it: the side of the location, and the side on which ties are broken.
+    Return the window unchanged if the point cannot continue outside of it.
+    """
+    top, bottom, left, right = window
+    x, y = point
+    width, height = size
+    if location_most in ("left", "right") and y == top:
+        top = max(0, top - height)
+    if location_most in ("top", "bottom") and x == left:
+        left = max(0, left - width)
+    if location_most == "left" and x == left:
+        left = max(0, left - width)
+    elif location_most == "right" and x == right - 1:
+        right = min(columns, right + width)
+    elif location_most == "top" and y == top:
+        top = max(0, top - height)
+    elif location_most == "bottom" and y == bottom - 1:
+        bottom = min(rows, bottom + height)
+    return top, bottom, left, right
+
+
+class SearchWindow:
+    """
+    Temporal search window that limits the point detection to the area around the last detection.
+    The window is centered on the last point or, with `use_velocity`, on a constant-velocity prediction.
+    When the point is not found inside the window (or lies on a side of the window where the extreme point, or a
+    tie with it, could continue outside of it), the target is considered lost and the detection falls back to a full-frame search.
+    Fallback policies:
+        - "full_frame": search the whole frame again on the same frame.
+        - "next_frame": report no point for this frame and search the whole frame on the next one.
+    """
+    FALLBACK_POLICIES = {"full_frame", "next_frame"}
+
+    def __init__(self, size: tuple, location_most: str, use_velocity: bool = True, fallback: str = "full_frame"):
+        """
+        Initialize the search window with its (width, height) size.
+        """
+        self.width, self.height = size
+        self.location_most = location_most
+        self.use_velocity = use_velocity
+        self.fallback = fallback
+        self._last_point = None
+        self._previous_point = None
+
+        # Statistics of the search
+        self.window_searches = 0
+        self.fallbacks = 0
+
+    def predict(self) -> tuple or None:
+        """
+        Predict the position of the point in the next frame.
+        """
+        if self._last_point is None:
+            return None
+        if not self.use_velocity or self._previous_point is None:
+            return self._last_point
+        return (2 * self._last_point[0] - self._previous_point[0],
+                2 * self._last_point[1] - self._previous_point[1])
+
+    def window(self, rows: int, columns: int) -> tuple or None:
+        """
+        Return the window (top, bottom, left, right) to search in the next frame, or None to search the whole frame.
+        """
+        prediction = self.predict()
+        if prediction is None:
+            return None
+        left = min(max(0, prediction[0] - self.width // 2), max(0, columns - self.width))
+        top = min(max(0, prediction[1] - self.height // 2), max(0, rows - self.height))
+        return top, min(rows, top + self.height), left, min(columns, left + self.width)
+
+    def is_reliable(self, point: tuple, window: tuple, rows: int, columns: int) -> bool:
+        """
+        Check that a point found inside the window is on none of the sides where the extreme point, or a point
+        winning the tie-break of the full-frame detection, could be outside of it.
+        """
+        return extend_window(window, point, self.location_most, (1, 1), rows, columns) == window
+
+    def update(self, point: tuple or None) -> None:
+        """
+        Update the window with the point detected in the current frame.
+        """
+        self._previous_point = self._last_point if point is not None else None
+        self._last_point = point
+
+    def statistics(self) -> str:
+        """
+        Summarize how often the search fell back to the whole frame.
+        """
+        ratio = self.fallbacks / self.window_searches * 100 if self.window_searches else 0
+        return (f"Search window: {self.window_searches} window searches, "
+                f"{self.fallbacks} fallbacks to full frame ({ratio:.1f}%).")
+
+
+def edge_crossing(outer_value: float, inner_value: float, level: float) -> float or None:
+    """
+    Locate where a profile, linearly interpolated from its value outside the edge to its value at the detected
+    point, crosses the level: 0 at the outer pixel and 1 at the point.
+    Return None if the profile doesn't cross the level between them.
+    """
+    if not outer_value < level <= inner_value:
+        return None
+    return (level - outer_value) / (inner_value - outer_value)
+
+
+class PointFilter:
+    """
+    Temporal filter of the point's position, with a constant velocity model and a step of one frame.
+    The filter starts from the first detected point and restarts when no point is detected.
+    """
+
+    def __init__(self):
+        """
+        Initialize the filter with no point.
+        """
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the point, e.g. when the target is lost.
+        """
+        self._started = False
+
+    def update(self, point: tuple or None) -> tuple or None:
+        """
+        Filter the point detected in the current frame and return the filtered point.
+        """
+        if point is None:
+            self.reset()
+            return None
+        if not self._started:
+            self._started = True
+            return self._start(point)
+        return self._correct(point)
+
+    def _start(self, point: tuple) -> tuple:
+        """
+        Start the filter from the point, with no velocity, and return it.
+        """
+        raise NotImplementedError
+
+    def _correct(self, point: tuple) -> tuple:
+        """
+        Predict the position in the current frame, correct it with the point and return it.
+        """
+        raise NotImplementedError
+
+
+class AlphaBetaFilter(PointFilter):
+    """
+    Alpha-beta filter of the point's position.
+    The position is corrected by `alpha` and the velocity by `beta` times the difference between the detected
+    point and the predicted one.
     """
-    if mask.max() == 255:
-        points = np.argwhere(mask == 255)
-        bottommost_point = points[np.argmax(points[:, 0])]
-        return tuple(bottommost_point[::-1])
+
+    def __init__(self, alpha: float = 0.5, beta: float = 0.1):
+        """
+        Initialize the filter with no point.
+        """
+        self.alpha = alpha
+        self.beta = beta
+        super().__init__()
+
+    def _start(self, point: tuple) -> tuple:
+        """
+        Start from the point with no velocity.
+        """
+        self._position, self._velocity = [float(point[0]), float(point[1])], [0.0, 0.0]
+        return tuple(self._position)
+
+    def _correct(self, point: tuple) -> tuple:
+        """
+        Correct the predicted position and velocity by fixed fractions of the residual.
+        """
+        for axis in range(2):
+            predicted = self._position[axis] + self._velocity[axis]
+            residual = point[axis] - predicted
+            self._position[axis] = predicted + self.alpha * residual
+            self._velocity[axis] += self.beta * residual
+        return tuple(self._position)
+
+
+class KalmanFilter(PointFilter):
+    """
+    Kalman filter of the point's position, for each axis.
+    The acceleration is modeled as white noise of variance `process_noise` (in pixels per frame squared) and the
+    detection as noisy with a variance of `measurement_noise` (in pixels squared). Unlike the alpha-beta filter,
+    the gains adapt while the filter converges.
+    """
+
+    def __init__(self, process_noise: float = 0.5, measurement_noise: float = 1.0):
+        """
+        Initialize the filter with no point.
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        super().__init__()
+
+    def _start(self, point: tuple) -> tuple:
+        """
+        Start from the point, with an uncertain velocity.
+        """
+        # State of every axis: position, velocity and their covariance (the velocity is unknown at first)
+        self._states = [[float(point[axis]), 0.0, self.measurement_noise, 0.0, 1e3] for axis in range(2)]
+        return float(point[0]), float(point[1])
+
+    def _correct(self, point: tuple) -> tuple:
+        """
+        Correct the predicted state of every axis with gains derived from its covariance.
+        """
+        q = self.process_noise
+        for axis, state in enumerate(self._states):
+            position, velocity, p00, p01, p11 = state
+
+            # Predict
+            position += velocity
+            p00, p01, p11 = p00 + 2 * p01 + p11 + q / 4, p01 + p11 + q / 2, p11 + q
+
+            # Correct with the detected position
+            innovation = p00 + self.measurement_noise
+            gain_position, gain_velocity = p00 / innovation, p01 / innovation
+            residual = point[axis] - position
+            position += gain_position * residual
+            velocity += gain_velocity * residual
+            p00, p01, p11 = (1 - gain_position) * p00, (1 - gain_position) * p01, p11 - gain_velocity * p01
+            state[:] = position, velocity, p00, p01, p11
+        return self._states[0][0], self._states[1][0]
+
+
+def create_point_filter(point_filter: str, alpha: float, beta: float, process_noise: float,
+                        measurement_noise: float) -> PointFilter or None:
+    """
+    Create the configured temporal filter of the point, or return None if the point is not filtered.
+    """
+    if point_filter == "alpha_beta":
+        return AlphaBetaFilter(alpha, beta)
+    if point_filter == "kalman":
+        return KalmanFilter(process_noise, measurement_noise)
     return None
+
+
+# Target of the multi-target mode: its ID, extreme point, centroid and area in pixels
+Target = namedtuple("Target", ["target_id", "point", "centroid", "area"])
+
+
+def detect_blobs(mask: np.ndarray, location_most: str, min_area: int = 1, offset: tuple = (0, 0)) -> list:
+    """
+    Label the connected components of the pixels with a value of 255 in a single pass.
+    Return a list of (point, centroid, area) per blob, where point is the extreme point of the blob
+    based on the specified location, with the same tie-breaking as `detect_point`.
+    The (x, y) offset is added to the coordinates, for masks that are a crop of the frame.
+    """
+    offset_x, offset_y = offset
+    binary = cv2.compare(mask, 255, cv2.CMP_EQ)
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+    blobs = []
+    for label in range(1, count):
+        left, top, width, height, area = stats[label]
+        if area < min_area:
+            continue
+        if location_most in ("left", "right"):
+            column = left if location_most == "left" else left + width - 1
+            point = (int(column), int(top + _first_index(labels[top:top + height, column], label)))
+        else:
+            row = top if location_most == "top" else top + height - 1
+            point = (int(left + _first_index(labels[row, left:left + width], label)), int(row))
+        blobs.append(((point[0] + offset_x, point[1] + offset_y),
+                      (float(centroids[label][0]) + offset_x, float(centroids[label][1]) + offset_y), int(area)))
+    return blobs
+
+
+class MultiTargetTracker:
+    """
+    Keeps stable IDs of the targets across frames with a greedy nearest-neighbour association of their centroids.
+    A target that is not detected for more than `max_missed_frames` frames is dropped.
+    """
+
+    def __init__(self, max_distance: float = 50, max_missed_frames: int = 5):
+        """
+        Initialize the tracker with no targets.
+        """
+        self.max_distance = max_distance
+        self.max_missed_frames = max_missed_frames
+        self._next_id = 1
+        self._centroids = {}
+        self._missed_frames = {}
+
+    def update(self, blobs: list) -> list:
+        """
+        Associate the blobs of the current frame to the known targets and return the targets.
+        """
+        target_ids = list(self._centroids)
+        assigned = [None] * len(blobs)
+
+        if target_ids and blobs:
+            known = np.array([self._centroids[target_id] for target_id in target_ids])
+            detected = np.array([centroid for _, centroid, _ in blobs])
+            distances = np.linalg.norm(known[:, np.newaxis, :] - detected[np.newaxis, :, :], axis=2)
+
+            # Assign the closest pairs first
+            for flat_index in np.argsort(distances, axis=None):
+                target_index, blob_index = divmod(int(flat_index), len(blobs))
+                if distances[target_index, blob_index] > self.max_distance:
+                    break
+                if assigned[blob_index] is None and target_ids[target_index] not in assigned:
+                    assigned[blob_index] = target_ids[target_index]
+
+        targets = []
+        for blob_index, (point, centroid, area) in enumerate(blobs):
+            target_id = assigned[blob_index]
+            if target_id is None:
+                target_id = self._next_id
+                self._next_id += 1
+            self._centroids[target_id] = centroid
+            self._missed_frames[target_id] = 0
+            targets.append(Target(target_id, point, centroid, area))
+
+        for target_id in target_ids:
+            if target_id not in assigned:
+                self._missed_frames[target_id] += 1
+                if self._missed_frames[target_id] > self.max_missed_frames:
+                    del self._centroids[target_id]
+                    del self._missed_frames[target_id]
+        return targets
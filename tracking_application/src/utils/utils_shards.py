@@ -0,0 +1,146 @@
+import logging
+import os
+import shutil
+import subprocess
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+from . import utils_config, utils_data, utils_frames, utils_track, utils_video
+
+"""
+This module provides functionalities to track a single video file in parallel.
+The video is split into frame ranges (shards); every shard is tracked in its own process after seeking to its
+first frame, and the CSV rows and video segments of the shards are stitched back in frame order.
+Detection is stateless per frame, so the result matches a serial run frame for frame.
+"""
+
+
+def split_frame_ranges(frame_count: int, shards: int) -> list:
+    """
+    Split the frames of a video into contiguous (start, end) ranges.
+    The last range is open-ended (end is None), so no frame is dropped if the frame count is inaccurate.
+    """
+    shards = max(1, min(shards, frame_count))
+    bounds = [frame_count * shard // shards for shard in range(shards + 1)]
+    ranges = [(bounds[shard], bounds[shard + 1]) for shard in range(shards)]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def _shard_config(config: utils_config.Config, shard: int) -> utils_config.Config:
+    """
+    Build the configuration of a shard, writing to its own part files.
+    """
+    shard_config = config.copy()
+    shard_config.set("show_video", False)
+    shard_config.set("output_name", f"{config.get('output_name')}_shard{shard:03d}")
+    shard_config.set("data_file_name", f"{config.get('data_file_name')}_shard{shard:03d}")
+    return shard_config
+
+
+def _run_shard(config: utils_config.Config, frame_range: tuple) -> int:
+    """
+    Track the frames of a shard and return the number of processed frames.
+    """
+    cv2.setNumThreads(1)
+    return utils_track.RunTrack(config, frame_range).run()
+
+
+def _stitch_data(config: utils_config.Config, shard_configs: list) -> None:
+    """
+    Concatenate the data files of the shards in order.
+    """
+    utils_data.concatenate_coordinates(config.get("output_directory"),
+                                       [shard_config.get("data_file_name") for shard_config in shard_configs],
+                                       config.get("data_file_name"), config.get("data_formats"))
+
+
+def _video_output_path(config: utils_config.Config) -> str:
+    """
+    Get the path of the output video of a configuration.
+    """
+    return utils_video.video_output_path(config.get("output_directory"), config.get("output_name"),
+                                         config.get("output_format"), config.get("video_output_mode"))
+
+
+def _stitch_video(config: utils_config.Config, shard_configs: list) -> None:
+    """
+    Concatenate the video segments of the shards.
+    The segments are copied without re-encoding when ffmpeg is available, otherwise they are re-encoded with OpenCV.
+    Raw frames and overlay metadata are concatenated as they are.
+    """
+    video_directory = os.path.join(config.get("output_directory"), 'video')
+    output_path = _video_output_path(config)
+    part_paths = [_video_output_path(shard_config) for shard_config in shard_configs]
+
+    if config.get("video_output_mode") != "encoded":
+        # Raw frames and overlay lines are appended as they are
+        with open(output_path, "wb") as file:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part_file:
+                    shutil.copyfileobj(part_file, file)
+    elif shutil.which("ffmpeg"):
+        list_path = os.path.join(video_directory, f'{config.get("output_name")}_shards.txt')
+        with open(list_path, "w") as file:
+            file.writelines(f"file '{os.path.abspath(part_path)}'\n" for part_path in part_paths)
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                        "-i", list_path, "-c", "copy", output_path], check=True)
+        os.remove(list_path)
+    else:
+        logging.warning("ffmpeg not found. Re-encoding the video segments of the shards with OpenCV.")
+        out = utils_track.RunTrack(config)._setup_video_writer()
+        for part_path in part_paths:
+            vs = cv2.VideoCapture(part_path)
+            grabbed, frame = vs.read()
+            while grabbed:
+                out.write(frame)
+                grabbed, frame = vs.read()
+            vs.release()
+        out.release()
+
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+def track_sharded(config: utils_config.Config, shards: int) -> int:
+    """
+    Track a video file split into the given number of shards, each one in its own process.
+    Return the number of processed frames.
+    """
+    if config.get("use_livecam"):
+        raise ValueError("Sharded tracking is only supported for video files.")
+    if config.get("multi_target"):
+        raise ValueError("Multi-target tracking keeps target IDs across frames and cannot be sharded.")
+    if config.get("show_video"):
+        logging.warning("Displaying video is not supported with shards. Disabling 'show_video'.")
+    if config.get("point_filter"):
+        logging.warning("The point filter restarts at the first frame of every shard.")
+
+    vs = cv2.VideoCapture(config.get("video_input_path"))
+    frame_count = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+    vs.release()
+    if frame_count <= 0:
+        raise RuntimeError("Couldn't read the number of frames of the video source.")
+
+    # The shards only read the frame cache, so the video is decoded into it first
+    if config.get("use_frame_cache"):
+        vs = utils_frames.open_frame_cache(config.get("video_input_path"), config.get("output_width"),
+                                           config.get("resize_interpolation"), config.get("frame_cache_max_mb"))
+        if vs is not None:
+            vs.release()
+
+    frame_ranges = split_frame_ranges(frame_count, shards)
+    shard_configs = [_shard_config(config, shard) for shard in range(len(frame_ranges))]
+    logging.info(f"Tracking {frame_count} frames in {len(frame_ranges)} shards...")
+    with ProcessPoolExecutor(max_workers=len(frame_ranges)) as executor:
+        shard_frame_counts = list(executor.map(_run_shard, shard_configs, frame_ranges))
+
+    # Every shard but the last one must have processed its whole range
+    for shard, ((start, end), shard_frame_count) in enumerate(zip(frame_ranges, shard_frame_counts)):
+        if end is not None and shard_frame_count != end - start:
+            raise RuntimeError(f"Shard {shard} processed {shard_frame_count} frames instead of {end - start}.")
+
+    if config.get("save_data"):
+        _stitch_data(config, shard_configs)
+    if config.get("save_video"):
+        _stitch_video(config, shard_configs)
+    return sum(shard_frame_counts)
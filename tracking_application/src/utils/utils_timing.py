@@ -0,0 +1,115 @@
+import time
+from collections import defaultdict
+import numpy as np
+
+"""
+Utility functions to measure the duration of the stages of the tracking.
+Stages are timed with chained timestamps, so measuring a stage costs one call:
+
+    t = timer.start()
+    ...
+    t = timer.stop("blur", t)
+    ...
+    timer.stop("hsv", t)
+
+`NullTimer` has the same interface and does nothing, so the instrumentation has almost no cost when disabled.
+"""
+
+# Stages of the tracking, in pipeline order
+STAGES = ["decode", "resize", "blur", "hsv", "in_range", "scene_mask", "detect", "subpixel", "filter", "draw",
+          "encode", "data_write", "display"]
+
+# Percentiles reported in the summaries
+PERCENTILES = (50, 95, 99)
+
+
+class NullTimer:
+    """
+    Timer that does not measure anything.
+    """
+    enabled = False
+
+    def start(self) -> float:
+        return 0.0
+
+    def stop(self, stage: str, start: float) -> float:
+        return 0.0
+
+    def start_run(self) -> None:
+        pass
+
+    def stop_run(self, frame_count: int) -> None:
+        pass
+
+
+class StageTimer(NullTimer):
+    """
+    Timer that keeps every duration of every stage of a tracking run.
+    """
+    enabled = True
+
+    def __init__(self):
+        """
+        Initialize the timer with no durations.
+        """
+        self.durations = defaultdict(list)
+        self.frame_count = 0
+        self.elapsed = 0.0
+        self._run_start = None
+
+    def start(self) -> float:
+        """
+        Return the timestamp at which a stage starts.
+        """
+        return time.perf_counter()
+
+    def stop(self, stage: str, start: float) -> float:
+        """
+        Record the duration of a stage that started at the given timestamp.
+        Return the current timestamp, so it can be used as start of the next stage.
+        """
+        now = time.perf_counter()
+        self.durations[stage].append(now - start)
+        return now
+
+    def start_run(self) -> None:
+        """
+        Mark the start of the processing of the frames.
+        """
+        self._run_start = time.perf_counter()
+
+    def stop_run(self, frame_count: int) -> None:
+        """
+        Mark the end of the processing of the frames.
+        """
+        self.elapsed = time.perf_counter() - self._run_start
+        self.frame_count = frame_count
+
+    def summary(self) -> dict:
+        """
+        Summarize the run: frames per second, per-frame latency and per-stage durations in milliseconds.
+        """
+        stages = {stage: summarize_durations(self.durations[stage])
+                  for stage in STAGES + sorted(set(self.durations) - set(STAGES) - {"frame"})
+                  if self.durations.get(stage)}
+        return {
+            "frames": self.frame_count,
+            "seconds": round(self.elapsed, 4),
+            "fps": round(self.frame_count / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": summarize_durations(self.durations.get("frame", [])),
+            "stages": stages,
+        }
+
+
+def summarize_durations(durations: list) -> dict:
+    """
+    Summarize durations in seconds as call count, mean, total and percentiles in milliseconds.
+    """
+    if not durations:
+        return {"calls": 0}
+    durations_ms = np.asarray(durations) * 1000
+    summary = {"calls": len(durations_ms), "mean": round(float(durations_ms.mean()), 4),
+               "total": round(float(durations_ms.sum()), 3)}
+    for percentile, value in zip(PERCENTILES, np.percentile(durations_ms, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 4)
+    return summary
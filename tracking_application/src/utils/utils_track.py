@@ -1,10 +1,11 @@
 import cv2
-import imutils
 import logging
-from imutils.video import VideoStream
+import numpy as np
+import threading
 import time
 import os
 from . import utils_config, utils_video, utils_point_track, utils_mask, utils_data
+from . import utils_pipeline, utils_timing, utils_metrics, utils_color, utils_frames
 
 """
 This module provides functionalities to track specific points in a video stream based on the provided configurations.
@@ -13,43 +14,109 @@ detecting the point of interest, and saving or displaying the results.
 """
 
 
+# Default values of the parameters that are not used when the tracker is used as a library (see track_frames)
+STREAM_DEFAULTS = {"use_livecam": False, "video_input_path": None, "save_video": False, "show_video": False,
+                   "show_mask": False, "save_data": False, "output_height": 0, "output_fps": 30,
+                   "output_format": "mp4", "output_name": "stream", "data_file_name": "stream",
+                   "point_color": [0, 0, 0], "point_border_color": [0, 0, 0], "point_radius": 0,
+                   "point_border_thickness": 0, "text_color": [0, 0, 0], "show_frame_number": False,
+                   "show_coordinates": False, "scene": None}
+
+
 class RunTrack:
     """
     Class to handle video tracking based on provided configurations.
     """
 
-    def __init__(self, config: utils_config.Config):
+    def __init__(self, config, frame_range: tuple = None, timer=None, started_at: float = None):
         """
-        Initialize the tracker with the given configuration.
+        Initialize the tracker with the given configuration (a Config or a CompiledConfig).
+        If a frame range (start, end) is given, only the frames from start (0-based, inclusive) to end
+        (exclusive, or None for the end of the video) of the video file are tracked.
+        If a timer (see utils_timing) is given, the duration of every stage of the tracking is measured.
+        The cold start is measured from `started_at` (a time.perf_counter() timestamp, e.g. taken when the process
+        starts), or from the creation of the tracker, to the first detection.
         """
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.cold_start = None
         self._extract_config_values(config)
+        self.frame_range = frame_range
+        self.timer = timer or self._setup_metrics()
+
+        # Set when the video stream is opened; frames given by the caller have no source
+        self.video_source_type = None
+        self.live_source = None
+        self.search_window = None
+        if self.use_search_window:
+            self.search_window = utils_point_track.SearchWindow(self.search_window_size, self.location_most,
+                                                                self.search_window_velocity,
+                                                                self.search_window_fallback)
+        self.target_tracker = None
+        if self.multi_target:
+            self.target_tracker = utils_point_track.MultiTargetTracker(self.association_distance,
+                                                                       self.max_missed_frames)
+        self.scene_masks = utils_mask.SceneMaskCache(self.scenes, self.scene_cache_size)
+
+        # The value channel is the maximum of B, G and R, so it can be computed without the HSV conversion
+        hue_and_saturation_full = (self.lower_color[0] <= 0 and self.upper_color[0] >= 179
+                                   and self.lower_color[1] <= 0 and self.upper_color[1] >= 255)
+        self._value_only = hue_and_saturation_full
+        self._value_gate = not hue_and_saturation_full and (self.lower_color[2] > 0 or self.upper_color[2] < 255)
+        self.color_lut = utils_color.ColorLUT(self.lower_color, self.upper_color) if self.use_color_lut else None
+
+        # Buffers reused across frames: the intermediate images are per thread, and the resized frame is only reused
+        # when the frames are processed and written one at a time, since it is drawn on and written afterwards
+        self._buffers = threading.local()
+        self._resize_buffer = None
+        self._reuse_resize_buffer = (self.pipeline_workers == 0
+                                     and not (self.save_video and self.video_writer_queue_size))
+
+        # Without video display nor saving of the annotated frames, nothing is drawn nor displayed
+        self.draw_frames = self.show_video or (self.save_video and self.video_output_mode != "overlay")
+        self._text_sprites = {}
+
+        # Coarse-to-fine detection: the point is detected on the frame downscaled to the coarse width (with the blur
+        # kernel scaled accordingly), then refined in a patch of the frame at the output resolution. When nothing is
+        # drawn, the frame is not resized to the output width: only the patch is
+        self._coarse_blur_ksize = None
+        if self.coarse_width:
+            ratio = self.coarse_width / self.output_width
+            self._coarse_blur_ksize = tuple(max(1, int(size * ratio)) // 2 * 2 + 1 for size in self.blur_ksize)
+        self.refinements = 0
+        self.refinement_extensions = 0
+
+        # The result of the last processed frame is reused for the unchanged frames
+        self.frame_gate = None
+        if self.skip_unchanged_frames:
+            self.frame_gate = utils_video.FrameChangeGate(self.frame_change_threshold, self.max_skipped_frames)
+        self._last_mask = None
+        self._last_result = None
+
+        # The detected point can be refined to a sub-pixel position and filtered over time, so its coordinates are
+        # then floats
+        self.point_filter_state = utils_point_track.create_point_filter(
+            self.point_filter, self.filter_alpha, self.filter_beta, self.filter_process_noise,
+            self.filter_measurement_noise)
+        self.float_coordinates = self.subpixel or self.point_filter_state is not None
 
     def _extract_config_values(self, config):
         """
-        Extract configuration values and set them as instance attributes.
+        Extract the values of the compiled configuration and set them as instance attributes.
         """
-        attributes = [
-            "use_livecam", "video_input_path", "output_width", "output_height", "lower_color",
-            "upper_color", "blur_ksize", "save_video", "show_video", "point_color",
-            "point_border_color", "point_radius", "point_border_thickness", "show_mask",
-            "output_format", "output_fps", "location_most", "scene", "show_frame_number",
-            "show_coordinates", "save_data", "text_color", "output_directory", "output_name",
-            "data_file_name"
-        ]
-        for attr in attributes:
-            setattr(self, attr, config.get(attr))
+        if isinstance(config, utils_config.Config):
+            config = config.compile()
+        for name, value in zip(config._fields, config):
+            setattr(self, name, value)
 
-    def _get_fourcc(self):
+    def _setup_metrics(self):
         """
-        Get the FourCC code for the specified video format.
+        Set up the metrics of the stages based on the configuration.
         """
-        format_to_fourcc = {
-            "avi": "XVID",
-            "mp4": "MP4V",
-            "mov": "MJPG"
-            # add more format-to-FourCC mappings as needed
-        }
-        return cv2.VideoWriter_fourcc(*str(format_to_fourcc.get(self.output_format.lower(), "XVID")))
+        if not self.metrics:
+            return utils_timing.NullTimer()
+        jsonl_path = os.path.join(self.output_directory, 'data', f'{self.data_file_name}_metrics.jsonl')
+        return utils_metrics.create_metrics_timer(self.metrics_sinks, self.metrics_interval_ms, self.metrics_window,
+                                                  jsonl_path, self.metrics_port)
 
     def _setup_video_stream(self):
         """
@@ -57,129 +124,816 @@ class RunTrack:
         """
         if not self.use_livecam:
             self.video_source_type = "video_file"
-            return cv2.VideoCapture(self.video_input_path)
+            self.live_source = None
+            vs = None
+            if self.use_frame_cache:
+                # Only a whole video is decoded into the cache
+                vs = utils_frames.open_frame_cache(self.video_input_path, self.output_width,
+                                                   self.resize_interpolation, self.frame_cache_max_mb,
+                                                   build=not self.frame_range)
+            if vs is None:
+                vs = cv2.VideoCapture(self.video_input_path)
+            if self.frame_range and self.frame_range[0] > 0 and vs.isOpened():
+                vs.set(cv2.CAP_PROP_POS_FRAMES, self.frame_range[0])
+                if int(vs.get(cv2.CAP_PROP_POS_FRAMES)) != self.frame_range[0]:
+                    raise RuntimeError(f"Couldn't seek to frame {self.frame_range[0]} of the video source.")
+            return vs
         else:
-            logging.info("Live camera turning on...")
+            # Grab the newest frames in a dedicated thread, replaying a video file at its frame rate if configured
+            if self.livecam_replay_path:
+                logging.info(f"Replaying {self.livecam_replay_path} as a live camera...")
+            else:
+                logging.info("Live camera turning on...")
             logging.info("TO STOP LIVE CAMERA, PRESS 'q'.")
             self.video_source_type = "webcam"
-            return VideoStream(src=0).start()
+            source = self.livecam_replay_path if self.livecam_replay_path else self.livecam_device
+            self.live_source = utils_video.LatestFrameGrabber(source, replay=bool(self.livecam_replay_path),
+                                                              timeout=self.livecam_timeout_ms / 1000)
+            return self.live_source.start()
+
+    def _video_output_path(self):
+        """
+        Get the path of the output video.
+        """
+        return utils_video.video_output_path(self.output_directory, self.output_name, self.output_format,
+                                             self.video_output_mode)
 
     def _setup_video_writer(self):
         """
         Set up the video writer based on the configuration.
+        The frames are encoded, or written raw, in a background thread unless the queue size is 0.
         """
-        fourcc = self._get_fourcc()
-        return cv2.VideoWriter(os.path.join(self.output_directory, 'video', f'{self.output_name}.{self.output_format}'),
-                               fourcc, self.output_fps, (self.output_width, self.output_height))
+        if self.video_output_mode == "overlay":
+            return utils_video.OverlayWriter(self._video_output_path(), self.multi_target)
+        if self.video_output_mode == "raw":
+            writer = utils_video.RawVideoWriter(self._video_output_path())
+        else:
+            writer = cv2.VideoWriter(self._video_output_path(), self.fourcc, self.output_fps,
+                                     (self.output_width, self.output_height))
+        if self.video_writer_queue_size:
+            return utils_video.AsyncVideoWriter(writer, self.video_writer_queue_size)
+        return writer
 
     def _get_frame(self, vs):
         """
-        Retrieve a frame from the video source.
+        Retrieve a frame from the video source, with its sequence number for a live source (None for a video file).
+        """
+        if not self.use_livecam:
+            return None, vs.read()[1]
+        captured = vs.read()
+        return (captured[0], captured[2]) if captured is not None else (None, None)
+
+    def _iter_frames(self, vs, first_frame_number: int = 1):
+        """
+        Iterate over the (frame_number, frame) pairs of the video source until there are no more frames
+        or the end of the frame range is reached.
+        The frames of a video file are numbered from the first frame number. The frames of a live source keep the
+        sequence number of the grabber, so the numbers of the frames dropped by the grabber are skipped.
+        """
+        frames_left = None
+        if self.frame_range and self.frame_range[1] is not None:
+            frames_left = self.frame_range[1] - self.frame_range[0]
+
+        frame_number = first_frame_number - 1
+        while frames_left is None or frames_left > 0:
+            t = self.timer.start()
+            sequence, frame = self._get_frame(vs)
+            self.timer.stop("decode", t)
+            if frame is None:
+                return
+            frame_number = sequence if sequence is not None else frame_number + 1
+            yield frame_number, frame
+            if frames_left is not None:
+                frames_left -= 1
+
+    def _iter_stacks(self, vs):
+        """
+        Decode the frames of the video source, resized to the output width, into a preallocated stack of
+        `batch_frames` frames. Yield the stack whenever it is full, and its filled part at the end of the video.
+        The stack is reused for the next frames unless the frames are written in the background.
+        When nothing is drawn, the stacks of the frame cache are read from its memory map without copying them.
+        """
+        if isinstance(vs, utils_frames.CachedVideoCapture) and not self.draw_frames:
+            yield from self._iter_cached_stacks(vs)
+            return
+
+        stack, count = None, 0
+        for _, frame in self._iter_frames(vs):
+            t = self.timer.start()
+            if stack is None:
+                width, height = utils_video.resized_size(*frame.shape[:2], self.output_width)
+                stack = np.empty((self.batch_frames, height, width, 3), dtype=np.uint8)
+            resized = utils_video.resize_frame(frame, self.output_width, self.resize_interpolation, stack[count])
+            if not np.may_share_memory(resized, stack):
+                stack[count] = resized
+            self.timer.stop("resize", t)
+            count += 1
+            if count == len(stack):
+                yield stack
+                stack, count = stack if self._reuse_resize_buffer else None, 0
+        if count:
+            yield stack[:count]
+
+    def _iter_cached_stacks(self, vs):
+        """
+        Read the frames of the frame cache by stacks of `batch_frames` frames until there are no more frames or the
+        end of the frame range is reached.
         """
-        frame = vs.read()
-        return frame[1] if not self.use_livecam else frame
+        frames_left = None
+        if self.frame_range and self.frame_range[1] is not None:
+            frames_left = self.frame_range[1] - self.frame_range[0]
 
-    def _process_frame(self, frame, frame_number):
+        while frames_left is None or frames_left > 0:
+            t = self.timer.start()
+            stack = vs.read_frames(self.batch_frames if frames_left is None else min(self.batch_frames, frames_left))
+            self.timer.stop("decode", t)
+            if stack is None or not len(stack):
+                return
+            yield stack
+            if frames_left is not None:
+                frames_left -= len(stack)
+
+    def _is_unchanged(self, frame) -> bool:
+        """
+        Check if the frame is unchanged since the last processed frame, comparing the region of interest of the scene
+        if it has one.
+        """
+        if not self.frame_gate:
+            return False
+        t = self.timer.start()
+        area = self.scene_masks.roi(self.scene, *frame.shape[:2]) if self.use_roi else None
+        unchanged = self.frame_gate.is_unchanged(frame, area)
+        self.timer.stop("gate", t)
+        return unchanged
+
+    def _detect_result(self, frame, reused: bool):
+        """
+        Detect the point (or the targets) in the frame, or reuse the result of the last processed frame.
+        Return the mask and the result.
+        """
+        if reused:
+            return self._last_mask.copy() if self.show_mask else None, self._last_result
+        if self.target_tracker:
+            mask, result = self._detect_targets(frame)
+        else:
+            mask, result = self._detect_point(frame)
+            result = self._estimate_point(frame, result)
+        # The shown mask is drawn on afterwards, so the mask reused for the unchanged frames is a copy of it
+        self._last_mask = mask.copy() if self.frame_gate and self.show_mask else mask
+        self._last_result = result
+        return mask, result
+
+    def _process_frame(self, frame):
         """
         Process the frame and apply the necessary transformations.
+        Return the image to show, the detected point (or targets), the time at which the processing started and
+        whether the result was reused from the last processed frame.
         """
-        frame = imutils.resize(frame, width=self.output_width)
-        blurred = cv2.GaussianBlur(frame, self.blur_ksize, sigmaX=0)
-        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
-        mask = cv2.inRange(hsv, tuple(self.lower_color), tuple(self.upper_color))
-        mask = utils_mask.modify_mask(mask, self.scene)
+        started_at = self.timer.start()
+        reused = self._is_unchanged(frame)
+        if self.draw_frames or not (reused or self.coarse_width):
+            t = self.timer.start()
+            frame = self._resize(frame)
+            self.timer.stop("resize", t)
+        if self.draw_frames and not frame.flags.writeable:
+            # The frames read from the frame cache are read-only
+            frame = frame.copy()
+
+        mask, result = self._detect_result(frame, reused)
+        if self.live_source:
+            self.live_source.record_latency()
 
-        point = utils_point_track.detect_point(mask, self.location_most)
         img_to_show = mask if self.show_mask else frame
+        if self.draw_frames:
+            t = self.timer.start()
+            self._draw_result(img_to_show, result)
+            self.timer.stop("draw", t)
+        return img_to_show, result, started_at, reused
 
-        if point:
-            self._draw_point(img_to_show, point)
+    def _process_stack(self, stack):
+        """
+        Process a stack of frames resized to the output width: threshold the whole stack, cover the areas of
+        non-interest of the scene in all the masks and detect their points in one reduction.
+        Return the results of the frames, as returned by _process_frame.
+        """
+        started_at = self.timer.start()
+        masks = self._modify_mask(self._threshold_stack(stack))
+        t = self.timer.start()
+        points = utils_point_track.detect_points(masks, self.location_most)
+        self.timer.stop("detect", t)
+
+        results = []
+        for frame, img_to_show, point in zip(stack, masks if self.show_mask else stack, points):
+            point = self._estimate_point(frame, point)
+            if self.draw_frames:
+                t = self.timer.start()
+                self._draw_result(img_to_show, point)
+                self.timer.stop("draw", t)
+            results.append((img_to_show, point, started_at, False))
+        return results
+
+    def _draw_result(self, img, result):
+        """
+        Draw the detected point, or the targets in multi-target mode, on the image.
+        """
+        if self.multi_target:
+            for target in result:
+                self._draw_point(img, target.point)
+                self._display_target_id(img, target)
+        elif result:
+            self._draw_point(img, result)
             if self.show_coordinates:
-                self._display_coordinates(img_to_show, point)
+                self._display_coordinates(img, result)
+
+    def _setup_data_writer(self):
+        """
+        Set up the writer of the tracking data based on the configuration.
+        """
+        if self.multi_target:
+            return utils_data.TargetsWriter(self.output_directory, self.data_file_name, self.data_formats,
+                                            self.data_flush_frames, self.data_flush_ms, self.skip_unchanged_frames)
+        return utils_data.CoordinatesWriter(self.output_directory, self.data_file_name, self.data_formats,
+                                            self.data_flush_frames, self.data_flush_ms, self.skip_unchanged_frames,
+                                            self.float_coordinates)
+
+    def _output_frame(self, frame_number, result, out, data_writer):
+        """
+        Save, write and display the result of a processed frame.
+        Return False if the tracking must stop.
+        """
+        img_to_show, point, started_at, reused = result
+        if self.cold_start is None:
+            self.cold_start = time.perf_counter() - self.started_at
+            logging.info(f"Cold start: first detection {self.cold_start * 1000:.0f} ms after start.")
+
+        t = self.timer.start()
+        if data_writer:
+            data_writer.write(frame_number, point, reused)
+        t = self.timer.stop("data_write", t)
+        if out and self.video_output_mode == "overlay":
+            out.write(frame_number, point)
+            t = self.timer.stop("encode", t)
+        if not self.draw_frames:
+            self.timer.stop("frame", started_at)
+            return True
+
+        if self.show_frame_number:
+            self._display_frame_number(img_to_show, frame_number)
+            t = self.timer.stop("draw", t)
+
+        if out and self.video_output_mode != "overlay":
+            out.write(img_to_show)
+            t = self.timer.stop("encode", t)
+        keep_tracking = True
+        if self.show_video:
+            utils_video.display_frame(img_to_show)
+            keep_tracking = not (cv2.waitKey(1) & 0xFF == ord("q"))
+            self.timer.stop("display", t)
+
+        self.timer.stop("frame", started_at)
+        return keep_tracking
+
+    def _buffer(self, name: str, shape: tuple) -> np.ndarray:
+        """
+        Return the buffer of the current thread with the given name, reallocated if its shape changes.
+        """
+        buffer = getattr(self._buffers, name, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+            setattr(self._buffers, name, buffer)
+        return buffer
+
+    def _resize(self, frame):
+        """
+        Resize the frame to the output width, into the buffer of the previous frame when possible.
+        """
+        resized = utils_video.resize_frame(frame, self.output_width, self.resize_interpolation, self._resize_buffer)
+        if self._reuse_resize_buffer and resized is not frame:
+            self._resize_buffer = resized
+        return resized
+
+    def _value_channel(self, image):
+        """
+        Compute the value channel of the HSV color space, i.e. the maximum of the B, G and R channels.
+        """
+        blue, green, red = cv2.split(image)
+        return cv2.max(cv2.max(blue, green, dst=blue), red, dst=blue)
+
+    def _threshold_image(self, image, blur_ksize: tuple = None):
+        """
+        Blur the image, convert it to the HSV color space and threshold it with the color range.
+        Only the pixels whose value is in the range can be in the mask, so the HSV conversion is skipped if the hue
+        and saturation ranges are full, and otherwise restricted to the bounding box of these pixels.
+        With the color lookup table, the mask is looked up in the table instead.
+        The image is blurred with the configured kernel size, unless another one is given.
+        """
+        t = self.timer.start()
+        blurred = cv2.GaussianBlur(image, blur_ksize or self.blur_ksize, sigmaX=0,
+                                   dst=self._buffer("blur", image.shape))
+        self.timer.stop("blur", t)
+        return self._threshold_blurred(blurred)
+
+    def _threshold_blurred(self, blurred):
+        """
+        Threshold the blurred image with the color range (see _threshold_image).
+        The thresholding is per pixel, so the image can be a stack of frames concatenated along the rows.
+        """
+        t = self.timer.start()
+        if self.color_lut:
+            mask = self.color_lut.threshold(blurred)
+            self.timer.stop("in_range", t)
+            return mask
+
+        if self._value_only:
+            mask = cv2.inRange(self._value_channel(blurred), self.lower_color[2], self.upper_color[2])
+            self.timer.stop("in_range", t)
+            return mask
+
+        if self._value_gate:
+            value_mask = cv2.inRange(self._value_channel(blurred), self.lower_color[2], self.upper_color[2],
+                                     dst=self._buffer("value_mask", blurred.shape[:2]))
+            left, top, width, height = cv2.boundingRect(value_mask)
+            mask = np.zeros(blurred.shape[:2], dtype=np.uint8)
+            if width == 0:
+                # No pixel to convert: only the value channel was thresholded
+                self.timer.stop("in_range", t)
+                return mask
+            hsv = cv2.cvtColor(blurred[top:top + height, left:left + width], cv2.COLOR_BGR2HSV)
+            t = self.timer.stop("hsv", t)
+            mask[top:top + height, left:left + width] = cv2.inRange(hsv, self.lower_bound, self.upper_bound)
+            self.timer.stop("in_range", t)
+            return mask
+
+        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV, dst=self._buffer("hsv", blurred.shape))
+        t = self.timer.stop("hsv", t)
+        mask = cv2.inRange(hsv, self.lower_bound, self.upper_bound)
+        self.timer.stop("in_range", t)
+        return mask
+
+    def _modify_mask(self, mask):
+        """
+        Cover the areas of non-interest of the scene in the mask.
+        """
+        t = self.timer.start()
+        mask = utils_mask.modify_mask(mask, self.scene, self.scene_masks)
+        self.timer.stop("scene_mask", t)
+        return mask
+
+    def _detect(self, mask):
+        """
+        Detect the point of interest in the mask.
+        """
+        t = self.timer.start()
+        point = utils_point_track.detect_point(mask, self.location_most)
+        self.timer.stop("detect", t)
+        return point
+
+    def _blur_margin(self, area: tuple, rows: int, columns: int, blur_ksize: tuple = None) -> tuple:
+        """
+        Extend the area (top, bottom, left, right) by the pixels within half the kernel size of it, which affect
+        the blur inside it.
+        """
+        kernel_width, kernel_height = blur_ksize or self.blur_ksize
+        top, bottom, left, right = area
+        return (max(0, top - kernel_height // 2), min(rows, bottom + kernel_height // 2),
+                max(0, left - kernel_width // 2), min(columns, right + kernel_width // 2))
+
+    def _threshold_frame(self, frame, window: tuple = None, blur_ksize: tuple = None):
+        """
+        Blur the frame and threshold it in the HSV color space.
+        If the scene has a region of interest or a search window is given, only this area plus a margin for the blur
+        is processed and the rest of the mask is covered with the mask value of the scene.
+        """
+        rows, columns = frame.shape[:2]
+        area = self.scene_masks.roi(self.scene, rows, columns) if self.use_roi else None
+        if window is not None:
+            area = window if area is None else (max(area[0], window[0]), min(area[1], window[1]),
+                                                max(area[2], window[2]), min(area[3], window[3]))
+        if area is None:
+            return self._threshold_image(frame, blur_ksize)
 
-        if self.save_data:
-            utils_data.save_coordinates(frame_number, point, self.output_directory, self.data_file_name)
-        return img_to_show
+        mask = np.full((rows, columns), self.scene_masks.mask_value(self.scene), dtype=np.uint8)
+        top, bottom, left, right = area
+        if top >= bottom or left >= right:
+            return mask
+
+        margin_top, margin_bottom, margin_left, margin_right = self._blur_margin(area, rows, columns, blur_ksize)
+        area_mask = self._threshold_image(frame[margin_top:margin_bottom, margin_left:margin_right], blur_ksize)
+        mask[top:bottom, left:right] = area_mask[top - margin_top:bottom - margin_top,
+                                                 left - margin_left:right - margin_left]
+        return mask
+
+    def _threshold_stack(self, stack):
+        """
+        Blur every frame of a stack of shape (K, H, W, 3) and threshold the whole stack at once.
+        As in _threshold_frame, only the region of interest of the scene plus a margin for the blur is processed.
+        Return the stack of masks.
+        """
+        count, rows, columns = stack.shape[:3]
+        area = self.scene_masks.roi(self.scene, rows, columns) if self.use_roi else None
+        if area is None:
+            area = margin = (0, rows, 0, columns)
+        else:
+            margin = self._blur_margin(area, rows, columns)
+        top, bottom, left, right = area
+        if top >= bottom or left >= right:
+            return np.full((count, rows, columns), self.scene_masks.mask_value(self.scene), dtype=np.uint8)
+
+        margin_top, margin_bottom, margin_left, margin_right = margin
+        t = self.timer.start()
+        blurred = self._buffer("blur_stack", (count, margin_bottom - margin_top, margin_right - margin_left, 3))
+        for frame, blurred_frame in zip(stack[:, margin_top:margin_bottom, margin_left:margin_right], blurred):
+            cv2.GaussianBlur(frame, self.blur_ksize, sigmaX=0, dst=blurred_frame)
+        self.timer.stop("blur", t)
+
+        if self.color_lut or self._value_gate:
+            # The HSV conversion is restricted to the bounding box of every frame, which is tighter than the one of
+            # the stack
+            area_masks = np.stack([self._threshold_blurred(blurred_frame) for blurred_frame in blurred])
+        else:
+            area_masks = self._threshold_blurred(blurred.reshape(-1, *blurred.shape[2:])).reshape(blurred.shape[:3])
+        area_masks = area_masks[:, top - margin_top:bottom - margin_top, left - margin_left:right - margin_left]
+        if area == (0, rows, 0, columns):
+            return area_masks
+        masks = np.full((count, rows, columns), self.scene_masks.mask_value(self.scene), dtype=np.uint8)
+        masks[:, top:bottom, left:right] = area_masks
+        return masks
+
+    def _threshold_patch(self, frame, window: tuple):
+        """
+        Threshold a window (top, bottom, left, right) of the frame at the output resolution and cover the areas of
+        non-interest of the scene in it. Only the window plus a margin for the blur is resized.
+        Return the mask of the window.
+        """
+        output_width, output_height = utils_video.resized_size(*frame.shape[:2], self.output_width)
+        margin_top, margin_bottom, margin_left, margin_right = self._blur_margin(window, output_height, output_width)
+        t = self.timer.start()
+        image = utils_video.resize_region(frame, self.output_width, (margin_top, margin_bottom, margin_left,
+                                                                     margin_right), self.resize_interpolation)
+        self.timer.stop("resize", t)
+
+        top, bottom, left, right = window
+        mask = self._threshold_image(image)[top - margin_top:bottom - margin_top,
+                                            left - margin_left:right - margin_left]
+        t = self.timer.start()
+        region = self.scene_masks.get(self.scene, output_height, output_width)
+        if region is not None:
+            np.copyto(mask, self.scene_masks.mask_value(self.scene), where=region[top:bottom, left:right])
+        self.timer.stop("scene_mask", t)
+        return mask
+
+    def _detect_coarse_to_fine(self, frame):
+        """
+        Detect the point on the frame downscaled to the coarse width, then refine it in a patch of the frame at the
+        output resolution, centered on the coarse point. The patch is extended while the refined point lies on a side
+        where the extreme point could continue outside of it.
+        Return the mask at the output resolution (only computed if it is shown) and the detected point.
+        """
+        t = self.timer.start()
+        coarse = utils_video.resize_frame(frame, self.coarse_width, self.resize_interpolation)
+        self.timer.stop("resize", t)
+        coarse_point = self._detect(self._modify_mask(self._threshold_frame(coarse,
+                                                                            blur_ksize=self._coarse_blur_ksize)))
+
+        output_width, output_height = utils_video.resized_size(*frame.shape[:2], self.output_width)
+        mask = None
+        if self.show_mask:
+            mask = np.full((output_height, output_width), self.scene_masks.mask_value(self.scene), dtype=np.uint8)
+        if coarse_point is None:
+            return mask, None
+
+        # Center the patch on the output pixels covered by the coarse point
+        self.refinements += 1
+        patch_width, patch_height = self.refine_patch_size
+        center_x = int((coarse_point[0] + 0.5) * output_width / coarse.shape[1])
+        center_y = int((coarse_point[1] + 0.5) * output_height / coarse.shape[0])
+        left = min(max(0, center_x - patch_width // 2), max(0, output_width - patch_width))
+        top = min(max(0, center_y - patch_height // 2), max(0, output_height - patch_height))
+        window = (top, min(output_height, top + patch_height), left, min(output_width, left + patch_width))
+
+        while True:
+            top, bottom, left, right = window
+            patch_mask = self._threshold_patch(frame, window)
+            point = self._detect(patch_mask)
+            if point is None:
+                break
+            point = (point[0] + left, point[1] + top)
+            extended_window = utils_point_track.extend_window(window, point, self.location_most,
+                                                              self.refine_patch_size, output_height, output_width)
+            if extended_window == window:
+                break
+            self.refinement_extensions += 1
+            window = extended_window
+
+        if mask is not None:
+            mask[top:bottom, left:right] = patch_mask
+        return mask, point
+
+    def _detect_point(self, frame):
+        """
+        Compute the mask of the frame and detect the point of interest in it.
+        With a search window, the point is first searched around the last detection and the whole frame
+        is only searched when the target is lost.
+        Return the mask and the detected point.
+        """
+        rows, columns = frame.shape[:2]
+        window = self.search_window.window(rows, columns) if self.search_window else None
+        if window is not None:
+            self.search_window.window_searches += 1
+            mask = self._modify_mask(self._threshold_frame(frame, window))
+            top, bottom, left, right = window
+            point = self._detect(mask[top:bottom, left:right])
+            if point is not None:
+                point = (point[0] + left, point[1] + top)
+                if self.search_window.is_reliable(point, window, rows, columns):
+                    self.search_window.update(point)
+                    return mask, point
+
+            # The target is lost
+            self.search_window.fallbacks += 1
+            if self.search_window.fallback == "next_frame":
+                self.search_window.update(None)
+                return mask, None
+
+        if self.coarse_width:
+            mask, point = self._detect_coarse_to_fine(frame)
+        else:
+            mask = self._modify_mask(self._threshold_frame(frame))
+            point = self._detect(mask)
+        if self.search_window:
+            self.search_window.update(point)
+        return mask, point
+
+    def _subpixel_point(self, frame, point):
+        """
+        Refine the detected point to the sub-pixel position of the edge along the direction of the location.
+        The blurred value (the V channel of HSV) of the point and of its neighbour outside the edge are computed in
+        floating point on a patch of the frame at the output resolution, and the edge is placed where the value
+        interpolated between them crosses the lower value bound of the color range.
+        The point is kept if the value doesn't cross it there, e.g. when the neighbour is excluded by its hue or
+        saturation, or when the point is on the border of the frame.
+        """
+        t = self.timer.start()
+        x, y = point
+        step_x, step_y = utils_point_track.OUTWARD_STEPS[self.location_most]
+        output_width, output_height = utils_video.resized_size(*frame.shape[:2], self.output_width)
+        if not (0 <= x + step_x < output_width and 0 <= y + step_y < output_height):
+            self.timer.stop("subpixel", t)
+            return point
+
+        area = (min(y, y + step_y), max(y, y + step_y) + 1, min(x, x + step_x), max(x, x + step_x) + 1)
+        top, bottom, left, right = self._blur_margin(area, output_height, output_width)
+        patch = utils_video.resize_region(frame, self.output_width, (top, bottom, left, right),
+                                          self.resize_interpolation)
+        value = cv2.GaussianBlur(patch.astype(np.float32), self.blur_ksize, sigmaX=0).max(axis=2)
+
+        # The blurred values are rounded before they are thresholded
+        fraction = utils_point_track.edge_crossing(value[y + step_y - top, x + step_x - left], value[y - top, x - left],
+                                                   self.lower_color[2] - 0.5)
+        if fraction is not None:
+            point = (x + step_x * (1 - fraction), y + step_y * (1 - fraction))
+        self.timer.stop("subpixel", t)
+        return point
+
+    def _estimate_point(self, frame, point):
+        """
+        Refine the detected point to a sub-pixel position and filter it over time, as configured.
+        """
+        if self.subpixel and point is not None:
+            point = self._subpixel_point(frame, point)
+        if self.point_filter_state:
+            t = self.timer.start()
+            point = self.point_filter_state.update(point)
+            self.timer.stop("filter", t)
+        return point
+
+    def _detect_targets(self, frame):
+        """
+        Compute the mask of the frame and detect the targets (connected blobs) in it, keeping their IDs across frames.
+        Return the mask and the targets.
+        """
+        mask = self._modify_mask(self._threshold_frame(frame))
+        t = self.timer.start()
+
+        # Only the region of interest of the scene can contain targets
+        rows, columns = mask.shape[:2]
+        roi = self.scene_masks.roi(self.scene, rows, columns) if self.use_roi else None
+        top, bottom, left, right = roi or (0, rows, 0, columns)
+        blobs = utils_point_track.detect_blobs(mask[top:bottom, left:right], self.location_most, self.min_blob_area,
+                                               (left, top))
+        targets = self.target_tracker.update(blobs)
+        self.timer.stop("detect", t)
+        return mask, targets
 
     def _draw_point(self, img, point):
         """
-        Draw the detected point on the image.
+        Draw the detected point on the image, at the nearest pixel of a sub-pixel point.
         """
+        point = (int(round(point[0])), int(round(point[1])))
         cv2.circle(img, point, self.point_radius, self.point_border_color, self.point_border_thickness)
         cv2.circle(img, point, self.point_radius - self.point_border_thickness, self.point_color, -1)
 
+    def _display_text(self, img, label, value, origin):
+        """
+        Display a label, drawn from its cached sprite, followed by a value.
+        """
+        sprite = self._text_sprites.get(label)
+        if sprite is None:
+            sprite = self._text_sprites[label] = utils_video.TextSprite(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        sprite.draw(img, origin, self.text_color)
+        cv2.putText(img, str(value), (origin[0] + sprite.width, origin[1]),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.text_color, 2)
+
     def _display_coordinates(self, img, point):
         """
         Display the point's coordinates
         """
-        x_coord_text = "X coordinate: {}".format(point[0])
-        y_coord_text = "Y coordinate: {}".format(point[1])
-        cv2.putText(img, x_coord_text, (self.output_width - 210, 60),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.text_color, 2)
-        cv2.putText(img, y_coord_text, (self.output_width - 210, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.text_color, 2)
+        x, y = (f"{point[0]:.1f}", f"{point[1]:.1f}") if self.float_coordinates else point
+        self._display_text(img, "X coordinate: ", x, (self.output_width - 210, 60))
+        self._display_text(img, "Y coordinate: ", y, (self.output_width - 210, 90))
+
+    def _display_target_id(self, img, target):
+        """
+        Display the ID of a target next to its point
+        """
+        text_position = (target.point[0] + self.point_radius, target.point[1] - self.point_radius)
+        cv2.putText(img, str(target.target_id), text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.text_color, 2)
 
     def _display_frame_number(self, img, frame_number):
         """
         Display frame number
         """
-        fps_text = "Frame number: {}".format(frame_number)
-        cv2.putText(img, fps_text, (self.output_width - 210, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.text_color, 2)
+        self._display_text(img, "Frame number: ", frame_number, (self.output_width - 210, 30))
+
+    def refinement_statistics(self) -> str:
+        """
+        Summarize how often the patch of the coarse-to-fine detection had to be extended.
+        """
+        ratio = self.refinement_extensions / self.refinements * 100 if self.refinements else 0
+        return (f"Coarse-to-fine: {self.refinements} refinements, {self.refinement_extensions} patch extensions "
+                f"({ratio:.1f}%).")
 
-    def run(self):
+    def iter_results(self, frames, first_frame_number: int = 1):
+        """
+        Lazily track the point in the given frames, without drawing, displaying or saving anything.
+        Yield the frame number and the detected point (or the targets in multi-target mode) of every frame.
+        """
+        self.timer.start_run()
+        frame_count = 0
+        try:
+            for frame_number, frame in enumerate(frames, start=first_frame_number):
+                started_at = self.timer.start()
+                reused = self._is_unchanged(frame)
+                if not (reused or self.coarse_width):
+                    t = self.timer.start()
+                    frame = self._resize(frame)
+                    self.timer.stop("resize", t)
+
+                result = self._detect_result(frame, reused)[1]
+                self.timer.stop("frame", started_at)
+                frame_count += 1
+                yield frame_number, result
+        finally:
+            self.timer.stop_run(frame_count)
+
+    def _run_stacks(self, vs, out, data_writer, first_frame_number: int) -> int:
+        """
+        Track the frames of the video file in stacks of `batch_frames` frames and output their results in order.
+        Return the number of processed frames.
+        """
+        frame_count = 0
+        for stack in self._iter_stacks(vs):
+            for result in self._process_stack(stack):
+                frame_count += 1
+                if not self._output_frame(first_frame_number + frame_count - 1, result, out, data_writer):
+                    return frame_count
+        return frame_count
+
+    def render(self, overlay: dict, multi_target: bool = None) -> int:
+        """
+        Render the annotated video from the overlay metadata of a previous tracking (see utils_video.load_overlay),
+        drawing the saved detections on the frames of the video source instead of detecting them again.
+        The mode of the tracking (`multi_target`), if known, must be the one of the config.
+        Return the number of rendered frames.
+        """
+        if multi_target is not None and multi_target != self.multi_target:
+            raise ValueError(f"The overlay was saved {'with' if multi_target else 'without'} 'multi_target', "
+                             f"unlike the config: set 'multi_target: {str(multi_target).lower()}' to render it.")
+
+        vs = self._setup_video_stream()
+        if not vs.isOpened():
+            logging.error("Error: Couldn't open video source.")
+            return 0
+
+        out = self._setup_video_writer()
+        first_frame_number = self.frame_range[0] + 1 if self.frame_range else 1
+        frame_count = 0
+        try:
+            for frame_number, frame in self._iter_frames(vs, first_frame_number):
+                img = utils_video.resize_frame(frame, self.output_width, self.resize_interpolation)
+                if not img.flags.writeable:
+                    img = img.copy()
+                self._draw_result(img, overlay.get(frame_number, [] if self.multi_target else None))
+                if self.show_frame_number:
+                    self._display_frame_number(img, frame_number)
+                out.write(img)
+                frame_count += 1
+        finally:
+            out.release()
+            vs.release()
+        return frame_count
+
+    def run(self) -> int:
         """
         Start the tracking process.
+        Return the number of processed frames.
         """
         vs = self._setup_video_stream()
         if self.video_source_type == "video_file" and not vs.isOpened():
             logging.error("Error: Couldn't open video source.")
-            return
+            return 0
 
-        time.sleep(2.0)  # Allow the camera or video file to warm up
+        # Allow the camera to warm up until it delivers its first frame
+        if self.video_source_type == "webcam" and not vs.wait_for_first_frame(self.livecam_warmup_ms / 1000):
+            logging.error(f"Error: No frame received from the live source within {self.livecam_warmup_ms} ms.")
+            vs.stop()
+            return 0
 
-        # Initialize the writer with the first frame to get correct dimensions
-        frame = self._get_frame(vs)
         out = self._setup_video_writer() if self.save_video else None
 
-        # Clear the .csv file before starting the tracking and write the headers
-        if self.save_data:
-            with open(os.path.join(self.output_directory, 'data', f'{self.data_file_name}.csv'), "w") as file:
-                file.write("frame_number,x_coordinate,y_coordinate\n")
-
-        frame_number = 0
-        while True:
-            if frame is None:
-                break
-
-            frame_number += 1
-            img_to_show = self._process_frame(frame, frame_number)
+        # Clear the data files before starting the tracking and write the headers
+        data_writer = self._setup_data_writer() if self.save_data else None
 
-            if self.show_frame_number:
-                self._display_frame_number(img_to_show, frame_number)
-
-            if self.save_video and out:
-                out.write(img_to_show)
-            if self.show_video:
-                utils_video.display_frame(img_to_show)
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
+        first_frame_number = self.frame_range[0] + 1 if self.frame_range else 1
+        frame_count = 0
+        self.timer.start_run()
+        try:
+            if self.pipeline_workers > 0:
+                # Overlap decoding, processing and encoding in a pipeline of threads
+                frame_count = utils_pipeline.run_pipeline(
+                    self._iter_frames(vs, first_frame_number), self._process_frame,
+                    lambda frame_number, result: self._output_frame(frame_number, result, out, data_writer),
+                    self.pipeline_workers, self.pipeline_queue_size)
+            elif self.batch_frames:
+                # Process the frames in stacks to amortize the overhead of the calls over the frames
+                frame_count = self._run_stacks(vs, out, data_writer, first_frame_number)
+            else:
+                for frame_number, frame in self._iter_frames(vs, first_frame_number):
+                    frame_count += 1
+                    if not self._output_frame(frame_number, self._process_frame(frame), out, data_writer):
+                        break
+        finally:
+            if data_writer:
+                data_writer.close()
+            self.timer.stop_run(frame_count)
 
-            frame = self._get_frame(vs)
+        if self.search_window:
+            logging.info(self.search_window.statistics())
+        if self.coarse_width:
+            logging.info(self.refinement_statistics())
+        if self.frame_gate:
+            logging.info(self.frame_gate.statistics())
 
         if self.video_source_type == "webcam":
             vs.stop()
+            logging.info(vs.statistics())
         else:
             vs.release()
 
         if out:
             out.release()
+            if self.video_output_mode == "raw":
+                writer = out.writer if isinstance(out, utils_video.AsyncVideoWriter) else out
+                logging.info(f"Raw frames saved. To encode them: "
+                             f"{writer.ffmpeg_command(self._video_output_path(), self.output_fps)}")
         cv2.destroyAllWindows()
+        return frame_count
+
+
+def track_frames(frames, config, first_frame_number: int = 1):
+    """
+    Utility function to use the tracker as a library on frames provided by the caller.
+    `frames` is any iterable of BGR frames, e.g. a generator or a NumPy batch of shape (N, H, W, 3).
+    `config` is a Config or a dict of parameters; the parameters of the outputs may be omitted.
+    Lazily yield (frame_number, point) tuples (or (frame_number, targets) in multi-target mode).
+    Nothing is displayed nor written to disk.
+
+    Basic Usage:
+        parameters = {"output_width": 1280, "lower_color": [0, 0, 242], "upper_color": [179, 56, 255],
+                      "blur_ksize": [49, 49], "location_most": "left", "scene": "glowing_bar_01"}
+        for frame_number, point in track_frames(frames, parameters):
+            ...
+    """
+    if isinstance(config, dict):
+        config = utils_config.Config.from_dict({**STREAM_DEFAULTS, **config})
+    return RunTrack(config).iter_results(frames, first_frame_number)
 
 
-def track(config: utils_config.Config):
+def track(config: utils_config.Config, started_at: float = None) -> int:
     """
     Utility function to initiate the tracking process.
+    If given, the cold start is measured from `started_at` (a time.perf_counter() timestamp).
+    Return the number of processed frames.
     """
-    tracker = RunTrack(config)
-    tracker.run()
+    tracker = RunTrack(config, started_at=started_at)
+    return tracker.run()
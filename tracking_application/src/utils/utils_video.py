@@ -1,12 +1,487 @@
 import cv2
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+from . import utils_timing, utils_point_track
 
 """
 Utility functions to work with video.
+`LatestFrameGrabber` reads a live source in a dedicated thread and only keeps the newest frame, tagged with its
+sequence number and capture timestamp, so the tracking never handles the same frame twice nor falls behind.
+A video file can be replayed at wall-clock rate as a stand-in for a camera.
+`TextSprite` draws a static text from pixels rendered once, instead of rasterizing the font on every frame.
+The output video is written by an `AsyncVideoWriter` in a background thread, either encoded, as raw frames, or as
+overlay metadata only (the detections drawn on every frame), from which the video can be rendered later.
+`FrameChangeGate` detects the frames unchanged since the last processed one, whose processing can be skipped.
 """
 
+# Modes of the output video: "encoded" with OpenCV, "raw" annotated frames, or "overlay" metadata only
+VIDEO_OUTPUT_MODES = {"encoded", "raw", "overlay"}
+
+# Interpolations available to resize the frames to the output width ("area" gives the best quality when downscaling,
+# "nearest" is the cheapest)
+RESIZE_INTERPOLATIONS = {"area": cv2.INTER_AREA, "linear": cv2.INTER_LINEAR, "nearest": cv2.INTER_NEAREST}
+
+
+def resized_size(rows: int, columns: int, width: int) -> tuple:
+    """
+    Get the (width, height) of a frame of the given shape resized to the given width, keeping its aspect ratio.
+    """
+    return width, int(rows * (width / float(columns)))
+
+
+def resize_frame(frame, width: int, interpolation: str = "area", dst=None):
+    """
+    Resize the frame to the given width, keeping its aspect ratio.
+    The frame is returned as is if it already has the given width. If a destination buffer of the resized shape is
+    given, the frame is resized into it.
+    """
+    rows, columns = frame.shape[:2]
+    if columns == width:
+        return frame
+    size = resized_size(rows, columns, width)
+    if dst is not None and dst.shape[:2] != (size[1], size[0]):
+        dst = None
+    return cv2.resize(frame, size, dst=dst, interpolation=RESIZE_INTERPOLATIONS[interpolation])
+
+
+def _aligned_span(start: int, end: int, size: int, source_size: int) -> tuple:
+    """
+    Extend the span [start, end) of a resized axis of the given size to whole periods of the scale, plus one period
+    of margin on each side, and return it with the matching span of the source axis.
+    A period is the smallest number of resized pixels that maps to a whole number of source pixels.
+    """
+    divisor = math.gcd(size, source_size)
+    period, source_period = size // divisor, source_size // divisor
+    first, last = max(0, start // period - 1), min(divisor, -(-end // period) + 1)
+    return first * period, last * period, first * source_period, last * source_period
+
+
+def resize_region(frame, width: int, region: tuple, interpolation: str = "area"):
+    """
+    Resize only a region (top, bottom, left, right, in resized pixels) of the frame to the given width.
+    The result has the same pixels as the region of the whole resized frame: the resized area is aligned on whole
+    periods of the scale, so every resized pixel is computed from the same source pixels with the same weights
+    (with the "linear" interpolation, the rounding of the weights can change a pixel by one intensity level).
+    """
+    rows, columns = frame.shape[:2]
+    top, bottom, left, right = region
+    if columns == width:
+        return frame[top:bottom, left:right]
+
+    height = resized_size(rows, columns, width)[1]
+    resized_top, resized_bottom, source_top, source_bottom = _aligned_span(top, bottom, height, rows)
+    resized_left, resized_right, source_left, source_right = _aligned_span(left, right, width, columns)
+    resized = cv2.resize(frame[source_top:source_bottom, source_left:source_right],
+                         (resized_right - resized_left, resized_bottom - resized_top),
+                         interpolation=RESIZE_INTERPOLATIONS[interpolation])
+    return resized[top - resized_top:bottom - resized_top, left - resized_left:right - resized_left]
+
+
+def video_output_path(output_directory: str, output_name: str, output_format: str, video_output_mode: str) -> str:
+    """
+    Get the path of the output video for the given output mode.
+    """
+    file_names = {"encoded": f"{output_name}.{output_format}", "raw": f"{output_name}.raw",
+                  "overlay": f"{output_name}_overlay.jsonl"}
+    return os.path.join(output_directory, 'video', file_names[video_output_mode])
+
 
 def display_frame(frame):
     """
     Display the processed frame.
     """
     cv2.imshow("Frame", frame)
+
+
+class TextSprite:
+    """
+    Static text rendered once, drawn on the frames by setting its pixels.
+    The pixels are cached per origin and frame shape, so drawing the text costs a single array assignment.
+
+    Basic Usage:
+        sprite = TextSprite("Frame number: ", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        sprite.draw(img, origin, color)
+        # The text following the sprite starts at (origin[0] + sprite.width, origin[1])
+    """
+
+    def __init__(self, text: str, font_face: int, font_scale: float, thickness: int):
+        """
+        Render the text and keep the offsets of its pixels from the origin (bottom-left corner of the text).
+        """
+        (width, height), baseline = cv2.getTextSize(text, font_face, font_scale, thickness)
+        margin = thickness
+        canvas = np.zeros((height + baseline + 2 * margin, width + 2 * margin), dtype=np.uint8)
+        cv2.putText(canvas, text, (margin, margin + height), font_face, font_scale, 255, thickness)
+        rows, columns = np.nonzero(canvas)
+        self._rows = rows - (margin + height)
+        self._columns = columns - margin
+        # getTextSize pads the width with the stroke thickness: the pen advance of the text is the width without it
+        self.width = width - thickness
+        self._pixels = {}
+
+    def draw(self, img, origin: tuple, color) -> None:
+        """
+        Draw the text on the image at the given origin, clipped to the image.
+        """
+        key = (origin, img.shape[:2])
+        pixels = self._pixels.get(key)
+        if pixels is None:
+            rows, columns = self._rows + origin[1], self._columns + origin[0]
+            inside = (rows >= 0) & (rows < img.shape[0]) & (columns >= 0) & (columns < img.shape[1])
+            pixels = self._pixels[key] = (rows[inside], columns[inside])
+        img[pixels] = color if img.ndim == 3 else color[0]
+
+
+class FrameChangeGate:
+    """
+    Detects the frames that are unchanged since the last processed frame, from a cheap signature of the frame:
+    its area of interest, sampled on a sparse grid and downscaled to a few cells. A frame is unchanged if no cell of
+    its signature differs from the one of the last processed frame by more than the threshold (in levels of the
+    B, G and R channels). Comparing with the last processed frame, not the previous one, keeps slow changes from
+    being missed, and at most `max_skipped_frames` frames in a row are skipped.
+
+    Basic Usage:
+        gate = FrameChangeGate(threshold=8, max_skipped_frames=30)
+        if not gate.is_unchanged(frame):
+            result = process(frame)
+    """
+    # Size (width, height) of the signatures, and minimum number of samples per cell of the sparse grid
+    SIGNATURE_SIZE = (32, 32)
+    SAMPLES_PER_CELL = 4
+
+    def __init__(self, threshold: int, max_skipped_frames: int):
+        """
+        Initialize the gate with the largest change of a cell for a frame to be unchanged.
+        """
+        self.threshold = threshold
+        self.max_skipped_frames = max_skipped_frames
+        self._reference = None
+        self._skipped_in_a_row = 0
+
+        # Statistics
+        self.frames = 0
+        self.skipped_frames = 0
+
+    def signature(self, frame, area: tuple = None) -> np.ndarray:
+        """
+        Compute the signature of the area (top, bottom, left, right) of the frame, or of the whole frame.
+        """
+        if area is not None and area[0] < area[1] and area[2] < area[3]:
+            frame = frame[area[0]:area[1], area[2]:area[3]]
+        width, height = self.SIGNATURE_SIZE
+        stride = max(1, min(frame.shape[0] // height, frame.shape[1] // width) // self.SAMPLES_PER_CELL)
+        samples = np.ascontiguousarray(frame[::stride, ::stride])
+        return cv2.resize(samples, self.SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+    def is_unchanged(self, frame, area: tuple = None) -> bool:
+        """
+        Check if the frame is unchanged since the last processed frame. If it is not, it becomes the last processed
+        frame.
+        """
+        self.frames += 1
+        signature = self.signature(frame, area)
+        if (self._reference is not None and self._reference.shape == signature.shape
+                and self._skipped_in_a_row < self.max_skipped_frames
+                and cv2.norm(signature, self._reference, cv2.NORM_INF) <= self.threshold):
+            self._skipped_in_a_row += 1
+            self.skipped_frames += 1
+            return True
+        self._reference = signature
+        self._skipped_in_a_row = 0
+        return False
+
+    def statistics(self) -> str:
+        """
+        Summarize how many frames were skipped.
+        """
+        ratio = self.skipped_frames / self.frames * 100 if self.frames else 0
+        return (f"Frame gate: {self.frames} frames, {self.skipped_frames} unchanged frames skipped "
+                f"({ratio:.1f}%).")
+
+
+class LatestFrameGrabber:
+    """
+    Grabs the frames of a camera (or a video file replayed at its frame rate) in a dedicated thread.
+    Reading returns the newest frame that has not been read yet; the frames grabbed in between are dropped.
+
+    Basic Usage:
+        grabber = LatestFrameGrabber(0).start()
+        sequence, captured_at, frame = grabber.read()
+        grabber.record_latency()
+        grabber.stop()
+    """
+
+    def __init__(self, source, replay: bool = False, timeout: float = 2.0):
+        """
+        Initialize the grabber on a camera index, or on a video file path to replay if `replay` is True.
+        `timeout` is the maximum time in seconds to wait for a new frame.
+        """
+        self._capture = cv2.VideoCapture(source)
+        self._replay = replay
+        self._replay_fps = (self._capture.get(cv2.CAP_PROP_FPS) or 30) if replay else None
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._finished = False
+
+        # Newest frame and its tags
+        self._frame = None
+        self._sequence = 0
+        self._captured_at = None
+        self._last_read_sequence = 0
+        self._last_read_captured_at = None
+
+        # Statistics
+        self.dropped_frames = 0
+        self.latencies = deque(maxlen=10000)
+
+    def isOpened(self) -> bool:
+        """
+        Check if the source has been opened.
+        """
+        return self._capture.isOpened()
+
+    def start(self):
+        """
+        Start grabbing frames in a dedicated thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._grab_frames, daemon=True)
+        self._thread.start()
+        return self
+
+    def _grab_frames(self):
+        """
+        Grab frames until the source ends or the grabber is stopped.
+        """
+        replay_start = time.perf_counter()
+        while self._running:
+            grabbed, frame = self._capture.read()
+            if not grabbed:
+                break
+
+            # Publish the replayed frames at the time they would have been captured
+            if self._replay:
+                delay = replay_start + self._sequence / self._replay_fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with self._condition:
+                self._sequence += 1
+                self._frame = frame
+                self._captured_at = time.perf_counter()
+                self._condition.notify_all()
+
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def wait_for_first_frame(self, timeout: float) -> bool:
+        """
+        Wait until the source delivers its first frame, for at most `timeout` seconds.
+        Return False if no frame arrived.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > 0 or self._finished, timeout)
+            return self._sequence > 0
+
+    def read(self) -> tuple or None:
+        """
+        Return the newest (sequence, captured_at, frame) that has not been read yet, waiting for it if needed.
+        The frames grabbed before the first read are not counted as dropped.
+        Return None if the source has ended or no frame arrives before the timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > self._last_read_sequence or self._finished,
+                                     self._timeout)
+            if self._sequence == self._last_read_sequence:
+                return None
+            if self._last_read_sequence:
+                self.dropped_frames += self._sequence - self._last_read_sequence - 1
+            self._last_read_sequence = self._sequence
+            self._last_read_captured_at = self._captured_at
+            return self._sequence, self._captured_at, self._frame
+
+    def record_latency(self) -> None:
+        """
+        Record the time elapsed since the capture of the last frame read.
+        """
+        if self._last_read_captured_at is not None:
+            self.latencies.append(time.perf_counter() - self._last_read_captured_at)
+
+    def stop(self) -> None:
+        """
+        Stop grabbing frames and release the source.
+        """
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self._capture.release()
+
+    def statistics(self) -> str:
+        """
+        Summarize the capture to point latency and the dropped frames.
+        """
+        summary = f"Live source: {self._sequence} frames captured, {self.dropped_frames} dropped"
+        if self.latencies:
+            latency = utils_timing.summarize_durations(list(self.latencies))
+            summary += (f", capture to point latency p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+                        f"p99 {latency['p99']:.1f} ms")
+        return summary + "."
+
+
+class AsyncVideoWriter:
+    """
+    Writes the frames with the given writer in a background thread, so the encoding doesn't block the tracking.
+    The queue of frames is bounded: writing blocks while it is full, so the tracking never runs ahead of the encoding
+    by more than `queue_size` frames. The written frames must not be modified afterwards.
+
+    Basic Usage:
+        out = AsyncVideoWriter(cv2.VideoWriter(...), queue_size=16)
+        out.write(frame)
+        out.release()
+    """
+
+    def __init__(self, writer, queue_size: int):
+        """
+        Start the thread writing the frames with the given writer.
+        """
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._error = None
+        self._thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._thread.start()
+
+    def _write_frames(self):
+        """
+        Write the queued frames until the writer is released.
+        """
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is None:
+                try:
+                    self.writer.write(frame)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, frame) -> None:
+        """
+        Queue a frame to write, waiting while the queue is full.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def release(self) -> None:
+        """
+        Write the remaining frames and release the writer.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.release()
+        if self._error is not None:
+            raise self._error
+
+
+class RawVideoWriter:
+    """
+    Writes the raw frames one after the other, without header, to render them later, e.g. with:
+        ffmpeg -f rawvideo -pix_fmt bgr24 -s <width>x<height> -r <fps> -i <output_name>.raw <output_name>.mp4
+    """
+
+    def __init__(self, path: str):
+        """
+        Open the file of the raw frames.
+        """
+        self._file = open(path, "wb")
+        self.frame_shape = None
+
+    def write(self, frame) -> None:
+        """
+        Append a frame to the file.
+        """
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        self._file.write(np.ascontiguousarray(frame).data)
+
+    def release(self) -> None:
+        """
+        Close the file.
+        """
+        self._file.close()
+
+    def ffmpeg_command(self, path: str, fps: int) -> str:
+        """
+        Get the ffmpeg command encoding the raw frames.
+        """
+        if self.frame_shape is None:
+            return ""
+        pixel_format = "bgr24" if len(self.frame_shape) == 3 else "gray"
+        return (f"ffmpeg -f rawvideo -pix_fmt {pixel_format} -s {self.frame_shape[1]}x{self.frame_shape[0]} "
+                f"-r {fps} -i {path} {os.path.splitext(path)[0]}.mp4")
+
+
+class OverlayWriter:
+    """
+    Writes the overlay metadata: a header line with the mode of the tracking, then one JSON line per frame with
+    detections, holding the drawn points (and the target IDs in multi-target mode). Frames without detections have
+    no line.
+    """
+
+    def __init__(self, path: str, multi_target: bool = False):
+        """
+        Open the file of the overlay metadata and write its header.
+        """
+        self._file = open(path, "w")
+        self._file.write(json.dumps({"multi_target": multi_target}) + "\n")
+
+    def write(self, frame_number: int, result) -> None:
+        """
+        Write the overlay of a frame, from its detected point or targets.
+        """
+        if not result:
+            return
+        if isinstance(result, list):
+            record = {"frame_number": frame_number, "points": [list(target.point) for target in result],
+                      "target_ids": [target.target_id for target in result]}
+        else:
+            record = {"frame_number": frame_number, "points": [list(result)]}
+        self._file.write(json.dumps(record) + "\n")
+
+    def release(self) -> None:
+        """
+        Close the file.
+        """
+        self._file.close()
+
+
+def load_overlay(path: str) -> tuple:
+    """
+    Load the overlay metadata as a dict from the frame numbers to their point, or their targets in multi-target mode.
+    Return the dict and whether the tracking was in multi-target mode (None if the file has no header).
+    """
+    overlay = {}
+    multi_target = None
+    with open(path, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            if "frame_number" not in record:
+                # Header, repeated in the overlays concatenated from shards
+                multi_target = record["multi_target"]
+                continue
+            points = [tuple(point) for point in record["points"]]
+            if "target_ids" in record:
+                overlay[record["frame_number"]] = [utils_point_track.Target(target_id, point, None, None)
+                                                   for target_id, point in zip(record["target_ids"], points)]
+            else:
+                overlay[record["frame_number"]] = points[0]
+    return overlay, multi_target
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tracking utils are imported from the source directory, as the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+import pytest
+from utils import utils_color
+
+
+def all_colors():
+    """
+    Image holding every BGR color once.
+    """
+    levels = np.arange(256, dtype=np.uint8)
+    colors = np.empty((256, 256, 256, 3), dtype=np.uint8)
+    colors[..., 0] = levels[:, None, None]
+    colors[..., 1] = levels[None, :, None]
+    colors[..., 2] = levels[None, None, :]
+    return colors.reshape(4096, 4096, 3)
+
+
+# Range of the provided configs, a hue band (both looked up), a range whose BGR box is exact and an empty range
+@pytest.mark.parametrize("lower_color, upper_color", [([0, 0, 251], [150, 35, 255]), ([20, 80, 60], [40, 255, 255]),
+                                                      ([0, 0, 0], [179, 255, 127]), ([90, 0, 0], [80, 255, 255])])
+def test_lut_mask_equals_the_range_of_the_hsv_conversion(tmp_path, lower_color, upper_color):
+    images = [all_colors(), np.random.default_rng(0).integers(0, 256, size=(240, 320, 3), dtype=np.uint8)]
+    # The table is built on the first use and loaded from the cache on the next ones
+    for cache_use in range(2):
+        color_lut = utils_color.ColorLUT(lower_color, upper_color, str(tmp_path))
+        for image in images:
+            expected = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), tuple(lower_color), tuple(upper_color))
+            np.testing.assert_array_equal(color_lut.threshold(image), expected)
@@ -0,0 +1,39 @@
+import pickle
+import pytest
+from utils import utils_config, utils_paths, utils_track
+
+
+def make_config(**parameters):
+    return utils_config.Config.from_dict({**utils_track.STREAM_DEFAULTS, "output_width": 320,
+                                          "lower_color": [0, 0, 200], "upper_color": [179, 255, 255],
+                                          "blur_ksize": [3, 3], "location_most": "top",
+                                          "scene": "glowing_bar_01", **parameters})
+
+
+def test_compiled_scenes_are_read_only():
+    compiled = make_config().compile()
+    scene = compiled.scenes["glowing_bar_01"]
+    with pytest.raises(TypeError):
+        compiled.scenes["glowing_bar_02"] = scene
+    with pytest.raises(TypeError):
+        scene["mask_value"] = 0
+    assert isinstance(scene["regions"], tuple)
+
+
+def test_constraints_are_enforced_on_parameters_set_after_loading(monkeypatch):
+    monkeypatch.setattr(utils_paths, "is_inside_docker", lambda: True)
+    config = make_config()
+    config.set("use_livecam", True)
+    assert config.get("use_livecam") is False
+
+    config = make_config(multi_target=True)
+    config.set("pipeline_workers", 4)
+    assert config.compile().pipeline_workers == 0
+
+
+def test_compiled_configuration_can_be_sent_to_another_process():
+    config = make_config()
+    config.compile()
+    compiled = pickle.loads(pickle.dumps(config)).compile()
+    assert compiled.scenes == config.compile().scenes
+    assert tuple(compiled.lower_bound) == compiled.lower_color == (0, 0, 200)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from utils import utils_config, utils_mask
+
+
+def original_scene_mask(mask, scene):
+    """
+    Per-pixel loops of the scene masks before they were declared in scenes.yml.
+    """
+    mask_ratio, mask_offset = {"glowing_bar_01": (0.9, 0.03), "glowing_bar_02": (3.5, 1)}[scene]
+    rows, columns = mask.shape
+    for row in range(rows):
+        for column in range(columns):
+            if scene == "glowing_bar_01" and row / rows > column / columns * mask_ratio - mask_offset:
+                mask[row, column] = 150
+            if scene == "glowing_bar_02" and row / rows < column / columns * mask_ratio - mask_offset:
+                mask[row, column] = 150
+    return mask
+
+
+@pytest.mark.parametrize("scene", ["glowing_bar_01", "glowing_bar_02"])
+@pytest.mark.parametrize("rows, columns", [(240, 428), (360, 640), (480, 854)])
+def test_compiled_scene_masks_are_identical_to_the_original_ones(scene, rows, columns):
+    scene_masks = utils_mask.SceneMaskCache(utils_mask.load_scenes(utils_config.Config.SCENES_FILE))
+    mask = np.random.default_rng(0).choice(np.array([0, 255], dtype=np.uint8), size=(rows, columns))
+
+    expected = original_scene_mask(mask.copy(), scene)
+    np.testing.assert_array_equal(utils_mask.modify_mask(mask, scene, scene_masks), expected)
@@ -0,0 +1,20 @@
+from utils import utils_pipeline
+
+
+def test_pipeline_outputs_frames_in_order_with_their_numbers():
+    frames = [(1, 10), (2, 20), (5, 50), (9, 90)]
+    outputs = []
+    count = utils_pipeline.run_pipeline(iter(frames), lambda frame: frame + 1,
+                                        lambda frame_number, result: outputs.append((frame_number, result)) or True,
+                                        workers=3, queue_size=2)
+    assert count == 4
+    assert outputs == [(1, 11), (2, 21), (5, 51), (9, 91)]
+
+
+def test_pipeline_stops_when_output_returns_false():
+    frames = [(frame_number, frame_number) for frame_number in range(1, 20)]
+    outputs = []
+    count = utils_pipeline.run_pipeline(iter(frames), lambda frame: frame,
+                                        lambda frame_number, result: outputs.append(frame_number) or frame_number < 3)
+    assert count == 3
+    assert outputs == [1, 2, 3]
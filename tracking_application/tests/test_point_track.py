@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from utils import utils_point_track
+
+
+def original_detect_point(mask, location_most):
+    """
+    Extreme point found in the coordinates of all the lit pixels, before the row/column reductions.
+    """
+    if mask.max() != 255:
+        return None
+    points = np.argwhere(mask == 255)
+    axis = 1 if location_most in ("left", "right") else 0
+    index = np.argmin(points[:, axis]) if location_most in ("left", "top") else np.argmax(points[:, axis])
+    return tuple(points[index][::-1])
+
+
+def random_masks(count, rows=48, columns=64):
+    """
+    Sparse masks with lit (255) and scene-covered (150) pixels, and many ties on the extreme rows and columns.
+    """
+    values = np.array([0, 150, 255], dtype=np.uint8)
+    masks = np.random.default_rng(0).choice(values, size=(count, rows, columns), p=[0.97, 0.01, 0.02])
+    masks[0] = 0
+    return masks
+
+
+@pytest.mark.parametrize("location_most", ["left", "right", "top", "bottom"])
+def test_detect_point_matches_the_original_detection(location_most):
+    for mask in random_masks(50):
+        assert utils_point_track.detect_point(mask, location_most) == original_detect_point(mask, location_most)
+
+
+@pytest.mark.parametrize("point_filter", [utils_point_track.AlphaBetaFilter(), utils_point_track.KalmanFilter()])
+def test_filter_restarts_from_the_point_after_a_reset(point_filter):
+    for x in range(0, 50, 5):
+        point_filter.update((x, 2 * x))
+    assert point_filter.update((100, 100)) != (100.0, 100.0)
+
+    point_filter.reset()
+    assert point_filter.update((100, 100)) == (100.0, 100.0)
+    assert point_filter.update((100, 100)) == (100.0, 100.0)
+
+
+@pytest.mark.parametrize("point_filter", [utils_point_track.AlphaBetaFilter(), utils_point_track.KalmanFilter()])
+def test_filter_restarts_from_the_point_after_a_lost_target(point_filter):
+    for x in range(0, 50, 5):
+        point_filter.update((x, 2 * x))
+
+    assert point_filter.update(None) is None
+    assert point_filter.update((100, 100)) == (100.0, 100.0)
+    assert point_filter.update((100, 100)) == (100.0, 100.0)
+
+
+def test_kalman_filter_converges_on_a_constant_velocity_track_and_restarts():
+    point_filter = utils_point_track.KalmanFilter()
+    for frame in range(30):
+        filtered = point_filter.update((10 + 3 * frame, 200 - 2 * frame))
+    assert filtered == pytest.approx((10 + 3 * 29, 200 - 2 * 29), abs=0.05)
+
+    # The velocity learnt on the track is forgotten with the target
+    assert point_filter.update(None) is None
+    assert point_filter.update((50, 50)) == (50.0, 50.0)
+    assert point_filter.update((50, 50)) == (50.0, 50.0)
+
+
+@pytest.mark.parametrize("location_most", ["left", "right", "top", "bottom"])
+def test_detect_points_on_a_stack_matches_detect_point_on_every_frame(location_most):
+    masks = random_masks(50)
+    expected = [utils_point_track.detect_point(mask, location_most) for mask in masks]
+    assert utils_point_track.detect_points(masks, location_most) == expected
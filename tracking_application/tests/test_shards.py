@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+import pytest
+from utils import utils_config, utils_shards, utils_track
+
+
+@pytest.mark.parametrize("frame_count", [1, 7, 100, 179, 1000])
+@pytest.mark.parametrize("shards", [1, 2, 3, 8, 12])
+def test_frame_ranges_cover_the_video_without_gaps_or_overlaps(frame_count, shards):
+    ranges = utils_shards.split_frame_ranges(frame_count, shards)
+
+    assert len(ranges) == min(shards, frame_count)
+    assert ranges[0][0] == 0 and ranges[-1][1] is None
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert start < end == next_start
+    assert ranges[-1][0] < frame_count
+
+
+def test_shards_read_every_frame_of_the_video_once(tmp_path):
+    # Every frame of the video is lit with its own index, recovered after decoding
+    path = str(tmp_path / "frames.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 48))
+    for index in range(23):
+        writer.write(np.full((48, 64, 3), index * 10, dtype=np.uint8))
+    writer.release()
+
+    config = utils_config.Config.from_dict({**utils_track.STREAM_DEFAULTS, "video_input_path": path,
+                                            "output_width": 64, "lower_color": [0, 0, 200],
+                                            "upper_color": [179, 255, 255], "blur_ksize": [3, 3],
+                                            "location_most": "left"})
+    frame_numbers, indices = [], []
+    for start, end in utils_shards.split_frame_ranges(23, 4):
+        tracker = utils_track.RunTrack(config, (start, end))
+        vs = tracker._setup_video_stream()
+        for frame_number, frame in tracker._iter_frames(vs, start + 1):
+            frame_numbers.append(frame_number)
+            indices.append(int(round(frame.mean() / 10)))
+        vs.release()
+
+    assert frame_numbers == list(range(1, 24))
+    assert indices == list(range(23))
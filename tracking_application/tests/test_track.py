@@ -0,0 +1,152 @@
+import cv2
+import logging
+import numpy as np
+import pytest
+from utils import utils_config, utils_point_track, utils_track, utils_video
+
+
+class FrameCollector:
+    """
+    Video writer keeping a copy of the written frames.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+    def release(self):
+        pass
+
+
+def make_config(**parameters):
+    """
+    Build a configuration tracking the top of a white square on 320x240 frames.
+    """
+    return utils_config.Config.from_dict({**utils_track.STREAM_DEFAULTS, "output_width": 320,
+                                          "lower_color": [0, 0, 200], "upper_color": [179, 255, 255],
+                                          "blur_ksize": [3, 3], "location_most": "top", "point_radius": 3,
+                                          "point_border_thickness": 1, "point_color": [255, 255, 255],
+                                          "text_color": [255, 255, 255], "save_video": True, **parameters})
+
+
+class FakeLiveSource:
+    """
+    Live source returning frames tagged with the given sequence numbers, as utils_video.LatestFrameGrabber.
+    """
+
+    def __init__(self, sequences):
+        self._sequences = list(sequences)
+
+    def read(self):
+        if not self._sequences:
+            return None
+        return self._sequences.pop(0), 0.0, make_frame()
+
+
+def make_frame():
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    frame[100:150, 40:90] = 255
+    return frame
+
+
+def track_and_collect(config, frames):
+    """
+    Process and output the frames one at a time, returning the written images and whether they were reused.
+    """
+    tracker = utils_track.RunTrack(config)
+    out = FrameCollector()
+    reused = []
+    for frame_number, frame in enumerate(frames, start=1):
+        result = tracker._process_frame(frame)
+        reused.append(result[3])
+        tracker._output_frame(frame_number, result, out, None)
+    return out.frames, reused
+
+
+def test_reused_mask_frame_matches_fresh_one():
+    frames = [make_frame(), make_frame(), make_frame()]
+    parameters = {"show_mask": True, "show_frame_number": True}
+    gated, reused = track_and_collect(make_config(skip_unchanged_frames=True, **parameters), frames)
+    fresh, _ = track_and_collect(make_config(**parameters), frames)
+
+    assert reused == [False, True, True]
+    for gated_image, fresh_image in zip(gated, fresh):
+        np.testing.assert_array_equal(gated_image, fresh_image)
+
+
+def test_live_frames_keep_the_sequence_numbers_of_the_grabber():
+    tracker = utils_track.RunTrack(make_config())
+    tracker.use_livecam = True
+    frame_numbers = [frame_number for frame_number, _ in tracker._iter_frames(FakeLiveSource([1, 2, 5, 6, 9]))]
+    assert frame_numbers == [1, 2, 5, 6, 9]
+
+
+def test_video_file_frames_are_numbered_from_the_first_frame_number():
+    class FakeVideoFile:
+        def __init__(self):
+            self.frames_left = 3
+
+        def read(self):
+            self.frames_left -= 1
+            return (True, make_frame()) if self.frames_left >= 0 else (False, None)
+
+    tracker = utils_track.RunTrack(make_config())
+    assert [frame_number for frame_number, _ in tracker._iter_frames(FakeVideoFile(), 11)] == [11, 12, 13]
+
+
+def test_label_sprite_and_value_match_a_single_text_within_one_pixel():
+    tracker = utils_track.RunTrack(make_config())
+    for label, value in [("X coordinate: ", 17), ("Y coordinate: ", 1279), ("Frame number: ", 45.5)]:
+        drawn = np.zeros((60, 320, 3), dtype=np.uint8)
+        tracker._display_text(drawn, label, value, (10, 40))
+        expected = np.zeros_like(drawn)
+        cv2.putText(expected, label + str(value), (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+        # The glyphs are placed in sub-pixels, so the strokes of the value may land one pixel aside
+        for image, other in [(drawn, expected), (expected, drawn)]:
+            rows, columns = np.nonzero(image[..., 0] != other[..., 0])
+            near = [image[row, column, 0] in other[max(row - 1, 0):row + 2, max(column - 1, 0):column + 2, 0]
+                    for row, column in zip(rows, columns)]
+            assert all(near), label
+
+
+def test_search_window_falls_back_when_the_extreme_row_continues_outside():
+    frames = [make_frame(), make_frame()]
+    # The top row of the second frame continues left of the window centered on the first point
+    frames[1][100:150, 0:40] = 255
+    config = make_config(use_search_window=True, search_window_size=[40, 40], search_window_velocity=False)
+    tracker = utils_track.RunTrack(config)
+
+    points = [tracker._process_frame(frame)[1] for frame in frames]
+    assert points[1] == (0, points[0][1])
+    assert tracker.search_window.fallbacks == 1
+
+
+def test_streaming_without_a_scene_logs_no_warning(caplog):
+    parameters = {"output_width": 320, "lower_color": [0, 0, 200], "upper_color": [179, 255, 255],
+                  "blur_ksize": [3, 3], "location_most": "top"}
+    with caplog.at_level(logging.WARNING):
+        results = list(utils_track.track_frames([make_frame()], parameters))
+    assert [frame_number for frame_number, _ in results] == [1]
+    assert not caplog.records
+
+
+def test_overlay_of_a_multi_target_run_is_not_rendered_as_a_single_target(tmp_path):
+    path = str(tmp_path / "stream_overlay.jsonl")
+    # Overlays of shards are concatenated, repeating the header
+    for frame_numbers in [(1, 2), (3,)]:
+        writer = utils_video.OverlayWriter(path + str(frame_numbers[0]), multi_target=True)
+        for frame_number in frame_numbers:
+            writer.write(frame_number, [utils_point_track.Target(7, (40, 100), (65, 125), 2500)])
+        writer.release()
+    with open(path, "w") as file:
+        file.write(open(path + "1").read() + open(path + "3").read())
+
+    overlay, multi_target = utils_video.load_overlay(path)
+    assert multi_target
+    assert sorted(overlay) == [1, 2, 3]
+    assert overlay[3][0].target_id == 7 and overlay[3][0].point == (40, 100)
+    with pytest.raises(ValueError, match="multi_target"):
+        utils_track.RunTrack(make_config()).render(overlay, multi_target)